@@ -0,0 +1,253 @@
+#!/bin/env python
+# Benchmark the spec pipeline of gen-definitions.py and check its output
+#
+# Times each stage of turning a spec into build files: parse (the spec, its includes and the
+# defaults file), resolve (the {{ }} variables), definitions (Definitions.mk) and modulefile,
+# over the specs of a synthetic admix written by gen-admix.py or of an existing admix. The
+# results are written as JSON so that runs of different commits can be compared with --compare.
+#
+# --check-golden compares the Definitions.mk, modulefile and Queries.sh answers of the specs in
+# yamlspecs/samples with the files in bench/golden, so that a faster pipeline is also a correct
+# one. --update-golden rewrites them after an intended change of the output.
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.dirname(BENCHDIR)
+STAGES = ['parse', 'resolve', 'definitions', 'modulefile']
+
+def loadModule(name,path):
+    """ Import the python file path (which need not be a valid module name) as name """
+    try:
+        import importlib.util
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+gendefs = loadModule("gendefs", os.path.join(TOPDIR, "gen-definitions.py"))
+genadmix = loadModule("genadmix", os.path.join(BENCHDIR, "gen-admix.py"))
+
+def freshState():
+    """ Forget what gen-definitions.py kept from the previous spec, as a new call would """
+    gendefs.incIndex = None
+    gendefs.yaml = None
+    gendefs.readFiles = {}
+    gendefs.mapUses = {}
+    # the loader is not part of the parse, a new call pays for it once
+    gendefs.getYaml()
+
+def specStages(yamlfile,dflts_file):
+    """ seconds spent in each of STAGES for yamlfile """
+    times = {}
+    freshState()
+    t0 = time.time()
+    mkp = gendefs.mkParser()
+    mkp.readPkgYaml(yamlfile)
+    mkp.readDefaultsYaml(dflts_file)
+    t1 = time.time()
+    mkp.resolveVars()
+    t2 = time.time()
+    gendefs.makeIncludeGenerator(mkp).generate()
+    t3 = time.time()
+    gendefs.moduleGenerator(mkp).generate()
+    t4 = time.time()
+    times['parse'], times['resolve'] = t1 - t0, t2 - t1
+    times['definitions'], times['modulefile'] = t3 - t2, t4 - t3
+    return times
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+def gitCommit():
+    """ the commit of the working tree, None if it is not a git checkout """
+    try:
+        out = subprocess.check_output(["git", "-C", TOPDIR, "rev-parse", "--short", "HEAD"],
+                                      stderr=open(os.devnull, 'w'))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode('utf-8').strip()
+
+def bench(admixdir,specs,repeat,dflts_file='pkg-defaults.yaml'):
+    """ Time STAGES over specs in admixdir repeat times. Returns the result dictionary:
+        for each stage the minimum, median and each run of the time for all specs """
+    cwd = os.getcwd()
+    os.chdir(admixdir)
+    runs = dict([(s, []) for s in STAGES])
+    try:
+        for r in range(repeat):
+            totals = dict([(s, 0.0) for s in STAGES])
+            for yamlfile in specs:
+                times = specStages(yamlfile, dflts_file)
+                for s in STAGES:
+                    totals[s] += times[s]
+            for s in STAGES:
+                runs[s].append(totals[s])
+    finally:
+        os.chdir(cwd)
+    stages = {}
+    for s in STAGES:
+        stages[s] = { 'min': min(runs[s]), 'median': median(runs[s]), 'runs': runs[s] }
+    total = [sum([runs[s][r] for s in STAGES]) for r in range(repeat)]
+    stages['total'] = { 'min': min(total), 'median': median(total), 'runs': total }
+    return { 'specs': len(specs), 'repeat': repeat, 'stages': stages }
+
+def compare(result,previous):
+    """ lines comparing each stage of result with previous, by the fastest run (the least
+        disturbed by other work on the host) """
+    lines = []
+    if result.get('params') != previous.get('params'):
+        lines.append("warning: the admixes differ: %s and %s" % (result.get('params'), previous.get('params')))
+    lines.append("%-12s %12s %12s %8s" % ("stage", previous.get('label') or previous.get('commit') or "previous",
+                                          result.get('label') or result.get('commit') or "this run", "change"))
+    for s in STAGES + ['total']:
+        if s not in previous['stages']:
+            continue
+        old, new = previous['stages'][s]['min'], result['stages'][s]['min']
+        change = (new - old) * 100.0 / old if old else 0.0
+        lines.append("%-12s %11.4fs %11.4fs %+7.1f%%" % (s, old, new, change))
+    return lines
+
+def summary(result):
+    lines = ["%d specs, %d runs, median (min) seconds per run" % (result['specs'], result['repeat'])]
+    for s in STAGES + ['total']:
+        st = result['stages'][s]
+        lines.append("  %-12s %9.4f (%.4f)" % (s, st['median'], st['min']))
+    return lines
+
+def goldenText(yamlfile,dflts_file='pkg-defaults.yaml'):
+    """ The Definitions.mk, modulefile and Queries.sh answers for yamlfile as one text. The
+        date and host in the modulefile header are replaced, an error is recorded as such """
+    freshState()
+    try:
+        mkp = gendefs.loadSpec(yamlfile, dflts_file, False, False)
+        parts = ["## %s" % gendefs.DEFINITIONS, gendefs.makeIncludeGenerator(mkp).generate()]
+        module = gendefs.moduleGenerator(mkp).generate().split("\n")
+        for i, line in enumerate(module):
+            if line.startswith("## Date:"):
+                module[i] = "## Date: DATE"
+            elif line.startswith("## Built on:"):
+                module[i] = "## Built on: HOST"
+        parts.extend(["## %s" % gendefs.MODULEFILE, "\n".join(module)])
+        parts.append("## %s" % gendefs.QUERIES)
+        qp = gendefs.queryProcessor(mkp)
+        for query, listSep in gendefs.EMIT_QUERIES:
+            parts.append("%s=%s" % (query, gendefs.shellQuote(qp.quietQuery(query, listSep))))
+    except Exception as ex:
+        parts = ["## error", str(ex)]
+    return "\n".join(parts) + "\n"
+
+def golden(samples,goldendir,update=False):
+    """ Compare (or with update, write) the golden file of each spec in samples. Returns the
+        names of the specs whose output differs """
+    import difflib
+    cwd = os.getcwd()
+    os.chdir(samples)
+    differ = []
+    try:
+        specs = sorted([f for f in os.listdir('.') if f.endswith('.yaml') and f != 'pkg-defaults.yaml'])
+        for yamlfile in specs:
+            text = goldenText(yamlfile)
+            goldfile = os.path.join(goldendir, os.path.splitext(yamlfile)[0] + ".txt")
+            if update:
+                if not os.path.isdir(goldendir):
+                    os.makedirs(goldendir)
+                with open(goldfile, 'w') as f:
+                    f.write(text)
+                continue
+            try:
+                with open(goldfile, 'r') as f:
+                    expected = f.read()
+            except (IOError, OSError):
+                expected = ""
+            if text != expected:
+                differ.append(yamlfile)
+                sys.stdout.writelines(difflib.unified_diff(expected.splitlines(True), text.splitlines(True),
+                                                           goldfile, yamlfile))
+    finally:
+        os.chdir(cwd)
+    return differ
+
+## *****************************
+## main routine
+## *****************************
+
+def main(argv):
+
+    # description and help lines for the usage  help
+    description = "times the parse, resolve, definitions and modulefile stages of gen-definitions.py over\n"
+    description += "the specs of a synthetic admix (options as in gen-admix.py) or of an existing admix, and\n"
+    description += "checks the output for the specs of yamlspecs/samples against bench/golden\n"
+
+    helpadmix = "benchmark the specs listed in modules.build of this admix directory (its yamlspecs/) instead\n"
+    helpadmix += "of a synthetic admix"
+    helpgolden = "compare the output for the specs of SAMPLES with the golden files, exit status 1 if any differ"
+
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawTextHelpFormatter)
+    genadmix.addOptions(parser)
+    parser.add_argument("-r", "--repeat",  dest="repeat",  default=5, type=int, help="number of runs, default is 5")
+    parser.add_argument("-a", "--admix",   dest="admix",   default=None, help=helpadmix)
+    parser.add_argument("-o", "--output",  dest="output",  default=None, help="write the results as JSON to this file")
+    parser.add_argument("--label",         dest="label",   default=None, help="name of this run in the results, default is the git commit")
+    parser.add_argument("--compare",       dest="compare", default=None, help="JSON results of an earlier run to compare with")
+    parser.add_argument("--check-golden",  dest="checkGolden", default=False, action='store_true', help=helpgolden)
+    parser.add_argument("--update-golden", dest="updateGolden", default=False, action='store_true', help="rewrite the golden files")
+    parser.add_argument("--samples",       dest="samples", default=os.path.join(TOPDIR, "yamlspecs", "samples"), help="specs for the golden files, default is yamlspecs/samples")
+    parser.add_argument("--golden",        dest="golden",  default=os.path.join(BENCHDIR, "golden"), help="directory of the golden files, default is bench/golden")
+    args = parser.parse_args(argv)
+
+    if args.checkGolden or args.updateGolden:
+        # the samples use the include files of this tree, not of an installed yaml2rpm
+        os.environ['YAML2RPM_INC'] = os.path.join(os.path.dirname(os.path.abspath(args.samples)), "include")
+        differ = golden(os.path.abspath(args.samples), os.path.abspath(args.golden), args.updateGolden)
+        if differ:
+            sys.stderr.write("output differs from the golden files for: %s\n" % " ".join(differ))
+            sys.exit(1)
+        return
+
+    tmpdir = None
+    if args.admix:
+        admixdir = args.admix
+        with open(os.path.join(admixdir, "modules.build"), 'r') as f:
+            specs = ["%s.yaml" % x for x in f.read().split()]
+        params = { 'admix': os.path.abspath(admixdir) }
+    else:
+        writer = genadmix.writerFromArgs(args)
+        tmpdir = admixdir = tempfile.mkdtemp(prefix="bench-admix-")
+        specs = writer.write(admixdir)
+        params = writer.params()
+    try:
+        result = bench(admixdir, specs, args.repeat)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+    result.update({ 'params': params, 'label': args.label, 'commit': gitCommit(),
+                    'python': "%d.%d.%d" % sys.version_info[:3], 'loader': gendefs.getYaml().backend,
+                    'host': socket.gethostname(), 'date': time.strftime("%Y-%m-%d %H:%M:%S") })
+
+    print("\n".join(summary(result)))
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            print("\n".join(compare(result, json.load(f))))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,141 @@
+#!/bin/env python
+# Write a synthetic admix to benchmark the spec pipeline of gen-definitions.py
+#
+# The admix has a pkg-defaults.yaml, a modules.build file and one spec per package. Each spec
+# line includes a chain of include files, refers to a chain of {{ }} variables and has
+# module.prepend_path, module.setenv and files lists. The sizes of all of these are set by
+# the options, so that the cost of each can be measured on its own.
+
+import argparse
+import os
+import sys
+
+class admixWriter(object):
+    """ Text of the files of a synthetic admix.
+            packages      number of package specs
+            includeDepth  length of the chain of line included files of each spec
+            defaultsSize  number of extra keys in pkg_defaults, each refers to another key
+            chainDepth    length of the chain of variables the version and description refer to
+            listSize      entries in the prepend_path, setenv and files lists of each spec """
+
+    def __init__(self,packages=50,includeDepth=3,defaultsSize=20,chainDepth=5,listSize=10):
+        self.packages = packages
+        self.includeDepth = includeDepth
+        self.defaultsSize = defaultsSize
+        self.chainDepth = chainDepth
+        self.listSize = listSize
+
+    def params(self):
+        """ the settings as a dictionary, recorded with the results of a benchmark """
+        return { 'packages': self.packages, 'include_depth': self.includeDepth,
+                 'defaults_size': self.defaultsSize, 'chain_depth': self.chainDepth,
+                 'list_size': self.listSize }
+
+    def name(self,i):
+        return "pkg%03d" % i
+
+    def defaults(self):
+        lines = ["---", "pkg_defaults:", "  app_path: /opt/apps",
+                 "  module:", "    path: /usr/share/Modules/modulefiles",
+                 "    prepend_path:", "      - PATH {{ root }}/bin", "      - LD_LIBRARY_PATH {{ root }}/lib"]
+        for k in range(self.defaultsSize):
+            ref = "pkg_defaults.key_%d" % (k - 1) if k else "pkg_defaults.app_path"
+            lines.append('  key_%d: "{{ %s }}/k%d"' % (k, ref, k))
+        return "\n".join(lines) + "\n"
+
+    def include(self,level):
+        """ inc-<level>.yaml, spliced into the package item of a spec """
+        lines = ["  inc_%d:" % level,
+                 '    name: "{{ name }}-inc%d"' % level,
+                 '    dir: "{{ root }}/inc%d"' % level]
+        if level < self.includeDepth:
+            lines.append("!include inc-%d.yaml" % (level + 1))
+        return "\n".join(lines) + "\n"
+
+    def spec(self,i):
+        name = self.name(i)
+        last = "chain_%d" % (self.chainDepth - 1) if self.chainDepth else "version"
+        lines = ["---",
+                 "- package: synthetic package %d" % i,
+                 "  name: %s" % name,
+                 '  pkgname: "{{ name }}_{{ version }}"',
+                 '  version: "1.%d"' % i]
+        for k in range(self.chainDepth):
+            ref = "chain_%d" % (k - 1) if k else "version"
+            lines.append('  chain_%d: "{{ %s }}.%d"' % (k, ref, k))
+        lines.extend(["  description: >",
+                      "    Synthetic package %s version {{ %s }},"  % (name, last),
+                      "    installed in {{ root }}.",
+                      "  vendor_source: https://example.org/%s-{{ version }}.tar.gz" % name,
+                      '  root: "{{ pkg_defaults.app_path }}/{{ name }}/{{ %s }}"' % last,
+                      "  build:",
+                      "    configure_args: --prefix={{ root }}",
+                      "    modules:",
+                      "  install:",
+                      "    installextra: $(INSTALL) -m 644 README $(ROOT){{ root }}"])
+        if i % 5 == 4:
+            # some packages need the one before, for --admix=pkgdeps
+            lines.extend(["  requires:", "    - %s_1.%d" % (self.name(i - 1), i - 1)])
+        lines.extend(["  module:",
+                      '    name: "{{ version }}"',
+                      '    path: "{{ pkg_defaults.module.path }}"',
+                      '    logname: "{{ name }}/{{ version }}"',
+                      "    setenv:"])
+        lines.extend(["      - %s_VAR%d {{ root }}/v%d" % (name.upper(), k, k) for k in range(self.listSize)])
+        lines.append("    prepend_path:")
+        lines.extend(["      - PATH%d {{ root }}/bin%d" % (k, k) for k in range(self.listSize)])
+        lines.append("  files:")
+        lines.extend(['    - "{{ root }}/f%d"' % k for k in range(self.listSize)])
+        if self.includeDepth > 0:
+            lines.append("!include inc-1.yaml")
+        return "\n".join(lines) + "\n"
+
+    def write(self,dirname):
+        """ Write the admix into dirname. Returns the names of the spec files """
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        files = { "pkg-defaults.yaml": self.defaults() }
+        for level in range(1, self.includeDepth + 1):
+            files["inc-%d.yaml" % level] = self.include(level)
+        specs = []
+        for i in range(self.packages):
+            specs.append("%s.yaml" % self.name(i))
+            files[specs[-1]] = self.spec(i)
+        files["modules.build"] = "\n".join([self.name(i) for i in range(self.packages)]) + "\n"
+        for fname in files:
+            with open(os.path.join(dirname, fname), 'w') as f:
+                f.write(files[fname])
+        return specs
+
+def addOptions(parser):
+    """ Add the options for the settings of admixWriter to an ArgumentParser """
+    parser.add_argument("-p", "--packages",      dest="packages",     default=50, type=int, help="number of packages, default is 50")
+    parser.add_argument("-i", "--include-depth", dest="includeDepth", default=3,  type=int, help="depth of nested line includes of each spec, default is 3")
+    parser.add_argument("-s", "--defaults-size", dest="defaultsSize", default=20, type=int, help="extra keys of pkg_defaults, default is 20")
+    parser.add_argument("-c", "--chain-depth",   dest="chainDepth",   default=5,  type=int, help="depth of the {{ }} variable chain of each spec, default is 5")
+    parser.add_argument("-l", "--list-size",     dest="listSize",     default=10, type=int, help="entries of prepend_path, setenv and files, default is 10")
+
+def writerFromArgs(args):
+    return admixWriter(args.packages, args.includeDepth, args.defaultsSize, args.chainDepth, args.listSize)
+
+## *****************************
+## main routine
+## *****************************
+
+def main(argv):
+
+    # description and help lines for the usage  help
+    description = "writes a synthetic admix: pkg-defaults.yaml, modules.build, include files and package\n"
+    description += "specs, to benchmark gen-definitions.py (see bench-specs.py)\n"
+
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawTextHelpFormatter)
+    addOptions(parser)
+    # required positional argument
+    parser.add_argument("dirname",  action="store", help="directory to write the admix into")
+    args = parser.parse_args(argv)
+
+    specs = writerFromArgs(args).write(args.dirname)
+    print("%d specs written to %s" % (len(specs), args.dirname))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -12,14 +12,22 @@ RPM.DESCRIPTION = $(DESCRIPTION). Configured with $(CONFIG.DESCRIPTION).
 RPM.DESCRIPTION += Modules loaded for compilation: $(MODULES)
 
 #COMPRESSED CAT
-ifneq (,$(findstring bz2, $(TARBALL-EXTENSION)))
-CAT-COMPRESS = bzcat
+## Parallel decompressors (pigz, pbzip2 or lbzip2, xz -T0, zstd -T0) are used when installed, 
+## the single threaded tools otherwise. Extensions tar.zst and tzst are zstd tarballs.
+## Define CAT-COMPRESS to use another command
+ifndef CAT-COMPRESS
+ifneq (,$(findstring zst, $(TARBALL-EXTENSION)))
+CAT-COMPRESS := $(if $(shell zstd -T0 -V 2>/dev/null),zstd -T0 -dc,zstd -dc)
+else ifneq (,$(findstring bz2, $(TARBALL-EXTENSION)))
+BZCAT-PARALLEL := $(firstword $(foreach t,pbzip2 lbzip2,$(if $(shell command -v $(t)),$(t))))
+CAT-COMPRESS := $(if $(BZCAT-PARALLEL),$(BZCAT-PARALLEL) -dc,bzcat)
 else ifneq (,$(findstring xz, $(TARBALL-EXTENSION)))
-CAT-COMPRESS = xzcat
+CAT-COMPRESS := $(if $(shell xz -T0 --version 2>/dev/null),xz -T0 -dc,xzcat)
 else ifneq (,$(findstring zip, $(TARBALL-EXTENSION)))
 CAT-COMPRESS = unzip 
 else
-CAT-COMPRESS = zcat
+CAT-COMPRESS := $(if $(shell command -v pigz),pigz -dc,zcat)
+endif
 endif
 
 #UNTAR
@@ -28,3 +36,57 @@ UNTAR = /bin/wc
 else
 UNTAR = $(TAR) -xf - 
 endif
+
+#COMPILER CACHE
+## CCACHE (build.ccache of the spec, else YAML2RPM_CCACHE set by yamlspecs/Makefile) = yes runs the
+## C, C++ and Fortran compilers of the build through ccache. CCACHE_COMPILERS found in PATH after
+## the modules are loaded are linked to ccache in CCACHE_LINKS, which is put first in PATH, so the
+## compilers of build.modules are cached too. Without ccache installed the build is not cached
+ifndef CCACHE
+CCACHE = $(YAML2RPM_CCACHE)
+endif
+CCACHE_COMPILERS = cc gcc c++ g++ gfortran f77 f95 clang clang++
+ifneq (,$(filter yes Yes YES true True on 1,$(CCACHE)))
+CCACHE_BIN := $(shell command -v ccache 2>/dev/null)
+ifeq (,$(CCACHE_BIN))
+$(warning CCACHE = $(CCACHE) but ccache is not installed, the compilers are not cached)
+endif
+endif
+ifneq (,$(CCACHE_BIN))
+CCACHE_LINKS = $(CURDIR)/ccache-bin
+CCACHE_SETUP = mkdir -p $(CCACHE_LINKS); for c in $(CCACHE_COMPILERS); do \
+	  command -v $$c > /dev/null && ln -sf $(CCACHE_BIN) $(CCACHE_LINKS)/$$c; done; \
+	  export PATH=$(CCACHE_LINKS):$$PATH CCACHE_BASEDIR=$(CURDIR)
+CCACHE_STATS = $(CURDIR)/ccache-stats.py
+else
+CCACHE_SETUP = :
+CCACHE_STATS = :
+endif
+
+#PARALLEL MAKE
+## PARALLEL_JOBS is what the host can give to this build: its cores, and its available memory at
+## PARALLEL_MEMPERJOB MB per job, divided among the YAML2RPM_BUILDJOBS packages built at once
+## (BUILDJOBS of yamlspecs/Makefile), at least 1. The default PKGMAKE runs make -j$(PARALLEL_JOBS),
+## also under make -jN: PKGMAKE is run through rpmbuild, which does not pass on the jobserver of
+## the outer make. This is a fixed share, not a pool shared by the builds: the cores of a build that
+## has finished are not given to those still running. PARALLEL (build.parallel of the spec) is a
+## job count to use instead, at most PARALLEL_JOBS when several packages are built at once, or no
+## for packages that fail with a parallel make
+ifndef PARALLEL_MEMPERJOB
+PARALLEL_MEMPERJOB = 2048
+endif
+PARALLEL_JOBS := $(shell b=$(or $(YAML2RPM_BUILDJOBS),1); j=$$(( $$(env -u OMP_NUM_THREADS -u OMP_THREAD_LIMIT nproc 2>/dev/null || echo 1) / b )); \
+	m=$$(awk '/^MemAvailable:/ { print int($$2 / 1024) }' /proc/meminfo 2>/dev/null); \
+	if [ -n "$$m" ] && [ $$(( m / ($(PARALLEL_MEMPERJOB) * b) )) -lt $$j ]; then j=$$(( m / ($(PARALLEL_MEMPERJOB) * b) )); fi; \
+	[ $$j -lt 1 ] && j=1; echo $$j)
+ifneq (,$(filter no No NO false False off 0 1,$(PARALLEL)))
+PARALLEL_FLAGS = -j1
+else ifneq (,$(filter-out yes Yes YES true True on auto,$(PARALLEL)))
+ifeq (,$(filter-out 0 1,$(or $(YAML2RPM_BUILDJOBS),1)))
+PARALLEL_FLAGS = -j$(PARALLEL)
+else
+PARALLEL_FLAGS = -j$(shell [ "$(PARALLEL)" -gt $(PARALLEL_JOBS) ] 2>/dev/null && echo $(PARALLEL_JOBS) || echo $(PARALLEL))
+endif
+else
+PARALLEL_FLAGS = -j$(PARALLEL_JOBS)
+endif
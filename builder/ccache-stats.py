@@ -0,0 +1,122 @@
+#!/bin/env python
+# Report the compiler cache hits and misses of a package build.
+#
+#    ccache-stats.py start STATEFILE
+#    ... the build, with the compilers run through ccache ...
+#    ccache-stats.py stop STATEFILE
+#
+# start saves the counters of the cache (CCACHE_DIR) in STATEFILE, stop prints how many
+# compilations since then were cache hits (direct and preprocessed) and misses, the hit rate
+# and the size of the cache. The cache is shared, so compilations of builds running at the
+# same time are counted too. The counters are read with ccache --print-stats (ccache 3.7 and
+# later) or from the summary of ccache -s.
+
+import json
+import os
+import subprocess
+import sys
+
+COUNTERS = ['direct_cache_hit', 'preprocessed_cache_hit', 'cache_miss']
+# lines of ccache -s of ccache without --print-stats
+SUMMARY_LINES = { 'cache hit (direct)': 'direct_cache_hit',
+                  'cache hit (preprocessed)': 'preprocessed_cache_hit',
+                  'cache miss': 'cache_miss' }
+
+def ccache(*args):
+    """ output of ccache with args, None if it fails """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            out = subprocess.check_output(('ccache',) + args, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode('utf-8', 'replace')
+
+def parsePrintStats(text):
+    """ counters of the tab separated output of ccache --print-stats """
+    counters = {}
+    for line in text.splitlines():
+        fields = line.split('\t')
+        if len(fields) == 2 and fields[1].strip().isdigit():
+            counters[fields[0].strip()] = int(fields[1])
+    return counters
+
+def parseSummary(text):
+    """ counters of the output of ccache -s of ccache 3.x """
+    counters = {}
+    for line in text.splitlines():
+        for label, name in SUMMARY_LINES.items():
+            if line.startswith(label):
+                value = line[len(label):].split()
+                if value and value[0].isdigit():
+                    counters[name] = int(value[0])
+    return counters
+
+def readCounters():
+    """ COUNTERS of the cache, None if they can not be read """
+    text = ccache('--print-stats')
+    counters = parsePrintStats(text) if text is not None else {}
+    if not counters:
+        text = ccache('-s')
+        if text is None:
+            return None
+        counters = parseSummary(text)
+    return dict([(name, counters.get(name, 0)) for name in COUNTERS])
+
+def cacheSize():
+    """ the 'cache size' line of ccache -s, None if there is none """
+    text = ccache('-s') or ""
+    for line in text.splitlines():
+        if line.strip().lower().startswith('cache size'):
+            return " ".join(line.split())
+    return None
+
+def report(before,after):
+    """ the line reporting the difference between the counters before and after """
+    delta = dict([(name, max(0, after[name] - before.get(name, 0))) for name in COUNTERS])
+    hits = delta['direct_cache_hit'] + delta['preprocessed_cache_hit']
+    total = hits + delta['cache_miss']
+    rate = "%.1f%%" % (hits * 100.0 / total) if total else "n/a"
+    return "ccache: %d hits (%d direct, %d preprocessed), %d misses, hit rate %s" % \
+           (hits, delta['direct_cache_hit'], delta['preprocessed_cache_hit'], delta['cache_miss'], rate)
+
+## *****************************
+## main routine
+## *****************************
+
+def main(argv):
+    if len(argv) != 2 or argv[0] not in ('start', 'stop'):
+        sys.stderr.write("usage: ccache-stats.py start STATEFILE | stop STATEFILE\n")
+        sys.exit(2)
+    statefile = argv[1]
+    # reporting must never fail the build
+    try:
+        if argv[0] == 'start':
+            counters = readCounters()
+            if counters is None:
+                sys.stderr.write("ccache-stats.py: can not read the ccache statistics\n")
+                return
+            with open(statefile, 'w') as f:
+                json.dump(counters, f)
+            return
+        try:
+            with open(statefile, 'r') as f:
+                before = json.load(f)
+        except (IOError, OSError, ValueError):
+            sys.stderr.write("ccache-stats.py: %s was not started\n" % statefile)
+            return
+        os.remove(statefile)
+        after = readCounters()
+        if after is None:
+            sys.stderr.write("ccache-stats.py: can not read the ccache statistics\n")
+            return
+        lines = [report(before, after)]
+        size = cacheSize()
+        if size:
+            lines.append("ccache: %s in %s" % (size, os.environ.get('CCACHE_DIR', "the default cache directory")))
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+    except Exception as ex:
+        sys.stderr.write("ccache-stats.py: %s: %s\n" % (argv[0], str(ex)))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,201 @@
+#!/bin/env python
+# Time the phases of a package build: wall time, CPU time and peak memory.
+#
+#    phase-timer.py start PHASE
+#    ... commands of the phase ...
+#    phase-timer.py stop PHASE STATUS
+#
+# start and stop are called from the same shell, the commands of the phase are run by that
+# shell. CPU time is what the shell and its finished children used (from /proc/<shell>/stat),
+# peak memory is the largest sum of the RSS of the shell and all its descendants, sampled
+# every SAMPLE_INTERVAL seconds by a background process (shorter peaks can be missed). stop appends a JSON line to the
+# file named by YAML2RPM_TIMINGS. Without YAML2RPM_TIMINGS nothing is recorded.
+
+import hashlib
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+SAMPLE_INTERVAL = 0.5
+TIMINGS_SUFFIX = '.timings.json'
+
+def procStat(pid):
+    """ fields of /proc/pid/stat after the command name, field 3 (state) is the first """
+    with open('/proc/%d/stat' % pid, 'r') as f:
+        text = f.read()
+    return text[text.rindex(')') + 2:].split()
+
+def cpuTimes(pid):
+    """ (user, system) seconds used by pid and its children it has waited for """
+    fields = procStat(pid)
+    ticks = float(os.sysconf('SC_CLK_TCK'))
+    utime, stime, cutime, cstime = [int(x) for x in fields[11:15]]
+    return (utime + cutime) / ticks, (stime + cstime) / ticks
+
+def isTimer(pid):
+    """ True if pid runs this script """
+    try:
+        with open('/proc/%d/cmdline' % pid, 'rb') as f:
+            return os.path.basename(__file__).encode('utf-8') in f.read()
+    except (IOError, OSError):
+        return False
+
+def treeRss(root):
+    """ sum of the resident memory (kB) of root and all its descendants, except phase-timer.py """
+    children = {}
+    rss = {}
+    pagekb = os.sysconf('SC_PAGE_SIZE') // 1024
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            fields = procStat(int(name))
+        except (IOError, OSError, ValueError):
+            continue
+        pid = int(name)
+        children.setdefault(int(fields[1]), []).append(pid)
+        rss[pid] = int(fields[21]) * pagekb
+    total = 0
+    todo = [root]
+    while todo:
+        pid = todo.pop()
+        if pid != root and isTimer(pid):
+            continue
+        total += rss.get(pid, 0)
+        todo.extend(children.get(pid, []))
+    return total
+
+class phaseTimer(object):
+    """ A phase of the build recorded in the timings file logfile. The state between start
+        and stop is kept in a temporary file named by logfile and phase """
+
+    def __init__(self, logfile, phase):
+        self.logfile = os.path.abspath(logfile)
+        self.phase = phase
+        key = hashlib.sha1(("%s %s" % (self.logfile, phase)).encode('utf-8')).hexdigest()
+        self.statefile = os.path.join(tempfile.gettempdir(), "yaml2rpm-timer-%d-%s" % (os.getuid(), key))
+        self.peakfile = self.statefile + ".peak"
+
+    def start(self):
+        shell = os.getppid()
+        user, system = cpuTimes(shell)
+        state = { 'shell': shell, 'start': time.time(), 'user': user, 'system': system }
+        state['sampler'] = self.startSampler(shell)
+        # the CPU used by this process is counted for the shell when it waits for it, it is
+        # not part of the phase
+        own = os.times()
+        state['user'] += own[0] + own[2]
+        state['system'] += own[1] + own[3]
+        with open(self.statefile, 'w') as f:
+            json.dump(state, f)
+
+    def startSampler(self, shell):
+        """ Start a detached process that records the peak RSS of the process tree of shell in
+            peakfile until it is sent SIGTERM or shell exits. Returns its pid """
+        rfd, wfd = os.pipe()
+        if os.fork() > 0:
+            os.close(wfd)
+            with os.fdopen(rfd, 'r') as r:
+                pid = int(r.read())
+            os.wait()
+            return pid
+        os.close(rfd)
+        os.setsid()
+        if os.fork() > 0:
+            os._exit(0)
+        with os.fdopen(wfd, 'w') as w:
+            w.write(str(os.getpid()))
+        # do not keep the output of the build (e.g. a pipe to tee) open
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        stopped = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopped.append(signum))
+        peak = 0
+        try:
+            while not stopped and os.path.exists('/proc/%d' % shell):
+                rss = treeRss(shell)
+                if rss > peak:
+                    peak = rss
+                    with open(self.peakfile, 'w') as f:
+                        f.write(str(peak))
+                time.sleep(SAMPLE_INTERVAL)
+        finally:
+            os._exit(0)
+
+    def stop(self, status):
+        """ Append the record of the phase to logfile """
+        try:
+            with open(self.statefile, 'r') as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            sys.stderr.write("phase-timer.py: %s was not started\n" % self.phase)
+            return
+        end = time.time()
+        self.stopSampler(state['sampler'])
+        user, system = cpuTimes(state['shell'])
+        try:
+            with open(self.peakfile, 'r') as f:
+                peak = int(f.read())
+        except (IOError, OSError, ValueError):
+            peak = 0
+        for fname in (self.statefile, self.peakfile):
+            if os.path.exists(fname):
+                os.remove(fname)
+        package = os.path.basename(self.logfile)
+        if package.endswith(TIMINGS_SUFFIX):
+            package = package[:-len(TIMINGS_SUFFIX)]
+        record = { 'package': package, 'phase': self.phase, 'start': round(state['start'], 3),
+                   'wall': round(end - state['start'], 3),
+                   'user': round(max(0.0, user - state['user']), 2),
+                   'system': round(max(0.0, system - state['system']), 2),
+                   'peak_rss_kb': peak, 'status': status, 'host': socket.gethostname() }
+        record['cpu'] = round(record['user'] + record['system'], 2)
+        # one write of one line, records of other phases are not mixed in
+        fd = os.open(self.logfile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(record, sort_keys=True) + "\n").encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def stopSampler(self, pid):
+        """ Stop the sampler and wait (at most a few seconds) until it has exited """
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            return
+        for i in range(int(4 / 0.05)):
+            try:
+                if procStat(pid)[0] == 'Z':
+                    return
+            except (IOError, OSError):
+                return
+            time.sleep(0.05)
+
+## *****************************
+## main routine
+## *****************************
+
+def main(argv):
+    logfile = os.environ.get('YAML2RPM_TIMINGS')
+    if len(argv) < 2 or argv[0] not in ('start', 'stop') or (argv[0] == 'stop' and len(argv) != 3):
+        sys.stderr.write("usage: phase-timer.py start PHASE | stop PHASE STATUS\n")
+        sys.exit(2)
+    if not logfile:
+        return
+    # timing must never fail the build
+    try:
+        timer = phaseTimer(logfile, argv[1])
+        if argv[0] == 'start':
+            timer.start()
+        else:
+            timer.stop(int(argv[2]))
+    except Exception as ex:
+        sys.stderr.write("phase-timer.py: %s %s: %s\n" % (argv[0], argv[1], str(ex)))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
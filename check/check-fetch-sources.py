@@ -0,0 +1,162 @@
+#!/bin/env python
+# Check fetch-sources.py against a local HTTP server
+#
+# Serves a temporary directory with the python http.server and runs fetch-sources.py on lists
+# of files in it: a download checked against its checksum, a checksum mismatch, a file taken
+# from the cache, --offline with and without the file in the cache, a file without a URL,
+# the mode of the files written and a cache blob rewritten in place through the sources directory.
+
+import functools
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+CHECKDIR = os.path.dirname(os.path.abspath(__file__))
+FETCHSOURCES = os.path.join(os.path.dirname(CHECKDIR), "fetch-sources.py")
+
+class quietHandler(SimpleHTTPRequestHandler):
+    """ Serves a directory without logging each request """
+    def log_message(self, format, *args):
+        pass
+
+class fetchSourcesCheck(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.served = tempfile.mkdtemp(prefix="check-served-")
+        handler = functools.partial(quietHandler, directory=cls.served)
+        cls.server = HTTPServer(('127.0.0.1', 0), handler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.url = "http://127.0.0.1:%d" % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.served)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="check-fetch-")
+        self.sources = os.path.join(self.tmpdir, "sources")
+        self.cache = os.path.join(self.tmpdir, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def serveFile(self, name, content):
+        """ Put name in the served directory, return its sha256 checksum """
+        with open(os.path.join(self.served, name), 'wb') as f:
+            f.write(content)
+        return "sha256:" + hashlib.sha256(content).hexdigest()
+
+    def fetch(self, lines, *options):
+        """ Run fetch-sources.py on lines, returns the exit status and the stdout and stderr text """
+        listfile = os.path.join(self.tmpdir, "sources.list")
+        with open(listfile, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        argv = [sys.executable, FETCHSOURCES, "--sources=" + self.sources, "--cache=" + self.cache,
+                "--timeout=10"] + list(options) + [listfile]
+        p = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        return p.returncode, out.decode('utf-8'), err.decode('utf-8')
+
+    def source(self, name):
+        with open(os.path.join(self.sources, name), 'rb') as f:
+            return f.read()
+
+    def testDownload(self):
+        checksum = self.serveFile("a-1.0.tar.gz", b"a source tarball")
+        status, out, err = self.fetch(["a a-1.0.tar.gz %s/a-1.0.tar.gz %s" % (self.url, checksum)])
+        self.assertEqual(status, 0, err)
+        self.assertIn("a-1.0.tar.gz: downloaded from", out)
+        self.assertEqual(self.source("a-1.0.tar.gz"), b"a source tarball")
+        status, out, err = self.fetch(["a a-1.0.tar.gz %s/a-1.0.tar.gz %s" % (self.url, checksum)])
+        self.assertEqual(status, 0, err)
+        self.assertIn("a-1.0.tar.gz: present", out)
+
+    def testMode(self):
+        checksum = self.serveFile("m-1.0.tar.gz", b"a readable tarball")
+        umask = os.umask(0o022)
+        try:
+            status, out, err = self.fetch(["m m-1.0.tar.gz %s/m-1.0.tar.gz %s" % (self.url, checksum)])
+        finally:
+            os.umask(umask)
+        self.assertEqual(status, 0, err)
+        blob = os.path.join(self.cache, "sha256", checksum.split(':')[1])
+        for path in (os.path.join(self.sources, "m-1.0.tar.gz"), blob):
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o644, path)
+
+    def testChecksumMismatch(self):
+        self.serveFile("b-1.0.tar.gz", b"not what the spec says")
+        wrong = "sha256:" + hashlib.sha256(b"the real tarball").hexdigest()
+        status, out, err = self.fetch(["b b-1.0.tar.gz %s/b-1.0.tar.gz %s" % (self.url, wrong)])
+        self.assertEqual(status, 1)
+        self.assertIn("checksum mismatch", err)
+        self.assertFalse(os.path.exists(os.path.join(self.sources, "b-1.0.tar.gz")))
+        self.assertEqual(os.listdir(os.path.join(self.cache, "sha256")), [])
+
+    def testCacheHit(self):
+        checksum = self.serveFile("c-1.0.tar.gz", b"a cached tarball")
+        line = "c c-1.0.tar.gz %s/c-1.0.tar.gz %s" % (self.url, checksum)
+        status, out, err = self.fetch([line])
+        self.assertEqual(status, 0, err)
+        os.remove(os.path.join(self.sources, "c-1.0.tar.gz"))
+        os.remove(os.path.join(self.served, "c-1.0.tar.gz"))
+        status, out, err = self.fetch([line])
+        self.assertEqual(status, 0, err)
+        self.assertIn("c-1.0.tar.gz: from the cache", out)
+        self.assertEqual(self.source("c-1.0.tar.gz"), b"a cached tarball")
+
+    def testOffline(self):
+        checksum = self.serveFile("d-1.0.tar.gz", b"an offline tarball")
+        line = "d d-1.0.tar.gz %s/d-1.0.tar.gz %s" % (self.url, checksum)
+        status, out, err = self.fetch([line], "--offline")
+        self.assertEqual(status, 1)
+        self.assertIn("offline", err)
+        self.assertFalse(os.path.exists(os.path.join(self.sources, "d-1.0.tar.gz")))
+        status, out, err = self.fetch([line])
+        self.assertEqual(status, 0, err)
+        os.remove(os.path.join(self.sources, "d-1.0.tar.gz"))
+        status, out, err = self.fetch([line], "--offline")
+        self.assertEqual(status, 0, err)
+        self.assertIn("d-1.0.tar.gz: from the cache", out)
+
+    def testNoURL(self):
+        status, out, err = self.fetch(["e e-extra.tar.gz - -"])
+        self.assertEqual(status, 1)
+        self.assertIn("has no URL", err)
+        self.assertIn("could not fetch: e-extra.tar.gz", err)
+
+    def testMirror(self):
+        self.serveFile("f-extra.tar.gz", b"an addsource file")
+        status, out, err = self.fetch(["f f-extra.tar.gz - -"], "--mirror=" + self.url)
+        self.assertEqual(status, 0, err)
+        self.assertEqual(self.source("f-extra.tar.gz"), b"an addsource file")
+
+    def testRewrittenBlob(self):
+        self.serveFile("g-extra.tar.gz", b"the first version")
+        line = "g g-extra.tar.gz %s/g-extra.tar.gz -" % self.url
+        status, out, err = self.fetch([line])
+        self.assertEqual(status, 0, err)
+        # rewritten in place, as wget -O does: the blob is a hard link of the file
+        with open(os.path.join(self.sources, "g-extra.tar.gz"), 'wb') as f:
+            f.write(b"edited in the sources directory")
+        shutil.rmtree(self.sources)
+        self.serveFile("g-extra.tar.gz", b"the second version")
+        status, out, err = self.fetch([line])
+        self.assertEqual(status, 0, err)
+        self.assertIn("g-extra.tar.gz: downloaded from", out)
+        self.assertEqual(self.source("g-extra.tar.gz"), b"the second version")
+
+if __name__ == "__main__":
+    unittest.main()
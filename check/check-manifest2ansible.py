@@ -0,0 +1,88 @@
+#!/bin/env python
+# Check the playbooks of manifest2ansible.py
+#
+# Pipes manifests into manifest2ansible.py, the way the ansible target of yamlspecs/Makefile
+# does, and compares the playbook with the one expected: names read from stdin by default, with
+# - and with --file -, comments and repeated names, and the ansible target itself on the specs
+# of yamlspecs/samples.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+CHECKDIR = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.dirname(CHECKDIR)
+MANIFEST2ANSIBLE = os.path.join(TOPDIR, "manifest2ansible.py")
+SAMPLES = os.path.join(TOPDIR, "yamlspecs", "samples")
+
+def playbook(admixName, pkgs):
+    lines = ["---",
+             "- name: %s admix packages" % admixName,
+             "  yum:",
+             '    name: "{{ pkglist }}"',
+             "    state: latest",
+             "  vars:",
+             "    pkglist:"]
+    lines.extend(["      - %s" % p for p in pkgs])
+    return "\n".join(lines) + "\n"
+
+class manifest2ansibleCheck(unittest.TestCase):
+
+    def run2ansible(self, args, stdin=""):
+        """ (exit status, stdout) of manifest2ansible.py args with stdin """
+        p = subprocess.Popen([sys.executable, MANIFEST2ANSIBLE] + args, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate(stdin.encode('utf-8'))
+        return p.returncode, out.decode('utf-8')
+
+    def testStdin(self):
+        manifest = "foundation-cmake\n# a comment\npigz_2.4 yaml2rpm\nfoundation-cmake  # again\n"
+        expected = (0, playbook("myadmix", ["foundation-cmake", "pigz_2.4", "yaml2rpm"]))
+        for args in (["--name", "myadmix"], ["--name", "myadmix", "-"], ["--name", "myadmix", "--file", "-"]):
+            self.assertEqual(self.run2ansible(args, manifest), expected, " ".join(args))
+
+    def testNamesAndStdin(self):
+        self.assertEqual(self.run2ansible(["--name", "x", "first", "-"], "second\nfirst\n"),
+                         (0, playbook("x", ["first", "second"])))
+
+    def testNoNames(self):
+        self.assertEqual(self.run2ansible(["--name", "x", "-"], "# nothing\n")[0], 1)
+
+    def testOutdir(self):
+        tmpdir = tempfile.mkdtemp(prefix="check-ansible-")
+        try:
+            with open(os.path.join(tmpdir, "gcc.manifest"), 'w') as f:
+                f.write("gcc_8.4.0\ngmp\n")
+            status, out = self.run2ansible(["--admix", "gcc=" + os.path.join(tmpdir, "gcc.manifest"),
+                                            "--admix", "mpi=-", "--outdir", os.path.join(tmpdir, "tasks")],
+                                           "openmpi\ngmp\n")
+            self.assertEqual(status, 0)
+            for name, pkgs in (("gcc", ["gcc_8.4.0", "gmp"]), ("mpi", ["openmpi", "gmp"])):
+                with open(os.path.join(tmpdir, "tasks", name + ".yml"), 'r') as f:
+                    self.assertEqual(f.read(), playbook(name, pkgs))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testAnsibleTarget(self):
+        env = dict(os.environ)
+        env['YAML2RPM_INC'] = os.path.join(TOPDIR, "yamlspecs", "include")
+        env['YAML2RPM_CACHE'] = 'off'
+        tmpdir = tempfile.mkdtemp(prefix="check-ansible-")
+        try:
+            admix = os.path.join(tmpdir, "yamlspecs")
+            shutil.copytree(SAMPLES, admix)
+            p = subprocess.Popen(["make", "-s", "-f", os.path.join(TOPDIR, "yamlspecs", "Makefile"),
+                                  "TEMPLATEDIR=" + TOPDIR, "ADMIX=samples", "ansible"],
+                                 cwd=admix, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = p.communicate()
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(p.returncode, 0, err.decode('utf-8'))
+        self.assertEqual(out.decode('utf-8'),
+                         playbook("samples", ["foundation-fcgi", "ior_3.0.1", "pigz_2.4", "yaml2rpm"]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/bin/env python
+# Check that the gen-definitions.py server answers as gen-definitions.py does
+#
+# Starts gen-definitions.py --server on a temporary socket and sends it calls through
+# gen-definitions-client.py for a spec that includes a file of YAML2RPM_INC with !include, which
+# includes another one. Between the calls the included files are changed, a file that shadows
+# the nested include is added to the directory of the spec and removed again. After each change
+# the answer of the server must be that of a gen-definitions.py run.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+CHECKDIR = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.dirname(CHECKDIR)
+GENDEFS = os.path.join(TOPDIR, "gen-definitions.py")
+CLIENT = os.path.join(TOPDIR, "gen-definitions-client.py")
+
+def loadModule(name,path):
+    """ Import the python file path (which need not be a valid module name) as name """
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+client = loadModule("genclient", CLIENT)
+
+class serverCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="check-server-")
+        self.inc = os.path.join(self.tmpdir, "include")
+        self.admix = os.path.join(self.tmpdir, "yamlspecs")
+        os.mkdir(self.inc)
+        os.mkdir(self.admix)
+        self.socket = os.path.join(self.tmpdir, "server.sock")
+        self.env = dict(os.environ)
+        self.env.update({ 'YAML2RPM_INC': self.inc, 'YAML2RPM_SERVER': self.socket,
+                          'YAML2RPM_CACHE': os.path.join(self.tmpdir, "cache") })
+        self.write(self.admix, "top.yaml", "package: top\nname: top\nversion: '1.0'\nrpm: !include extra.yaml\n")
+        self.write(self.inc, "extra.yaml", "name: extra\nleaf: !include leaf.yaml\n")
+        self.write(self.inc, "leaf.yaml", "value: from-include\n")
+        self.server = subprocess.Popen([sys.executable, GENDEFS, "--server", self.socket, "--server-idle=120"],
+                                       env=self.env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        deadline = time.time() + 30
+        while not os.path.exists(self.socket):
+            if self.server.poll() is not None or time.time() > deadline:
+                self.fail("the server did not start: %s" % self.server.communicate()[0].decode('utf-8'))
+            time.sleep(0.05)
+
+    def tearDown(self):
+        if self.server.poll() is None:
+            subprocess.call([sys.executable, GENDEFS, "--server-stop", self.socket], env=self.env)
+            self.server.wait()
+        self.server.stdout.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, dirname, name, text):
+        with open(os.path.join(dirname, name), 'w') as f:
+            f.write(text)
+
+    def direct(self, argv):
+        """ (status, stdout) of gen-definitions.py argv run in the directory of the spec """
+        p = subprocess.Popen([sys.executable, GENDEFS] + argv, cwd=self.admix, env=self.env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        return p.returncode, out.decode('utf-8')
+
+    def served(self, argv):
+        """ (status, stdout) of the server for argv, the call must be answered by the server """
+        cwd = os.getcwd()
+        environ = dict(os.environ)
+        os.chdir(self.admix)
+        os.environ.update(self.env)
+        try:
+            reply = client.callServer(self.socket, argv)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            os.chdir(cwd)
+        self.assertIsNotNone(reply, "the server did not answer %s" % " ".join(argv))
+        return reply['status'], reply['stdout']
+
+    def check(self, value):
+        """ The server and gen-definitions.py give the same answers, with value for rpm.leaf.value """
+        for argv in (["--no-defaults", "--query=rpm.leaf.value", "top.yaml"], ["--no-defaults", "top.yaml"]):
+            self.assertEqual(self.served(argv), self.direct(argv), " ".join(argv))
+        self.assertEqual(self.served(["--no-defaults", "--query=rpm.leaf.value", "top.yaml"]), (0, value + "\n"))
+
+    def testChangedIncludes(self):
+        self.check("from-include")
+        self.write(self.inc, "leaf.yaml", "value: edited-include\n")
+        self.check("edited-include")
+        # comes before the include path and shadows the nested include of extra.yaml
+        self.write(self.admix, "leaf.yaml", "value: from-yamlspecs\n")
+        self.check("from-yamlspecs")
+        os.remove(os.path.join(self.admix, "leaf.yaml"))
+        self.check("edited-include")
+        self.write(self.inc, "extra.yaml", "name: extra-renamed\nleaf: !include leaf.yaml\n")
+        self.check("edited-include")
+        os.remove(os.path.join(self.inc, "leaf.yaml"))
+        status, out = self.served(["--no-defaults", "top.yaml"])
+        self.assertNotEqual(status, 0)
+        self.assertEqual(self.direct(["--no-defaults", "top.yaml"])[0], status)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,337 @@
+#!/bin/env python
+# Fetch the source tarballs of an admix into its sources directory
+#
+# Reads the output of gen-definitions.py --admix=sources: one line per source file with the
+# spec name, file name, URL and checksum ('-' if there is none). Files are downloaded by
+# several workers at once, checked against the checksum and kept in a cache shared by all
+# admixes, in which each file is stored once under the sha256 of its contents.
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# hash algorithm of a checksum given without one, by the length of the hex digest
+ALGORITHMS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+BLOCKSIZE = 1024 * 1024
+
+# mode of the files written, as open() would make them: readable by the group and others
+# that share a sources directory or the cache unless the umask says otherwise
+UMASK = os.umask(0)
+os.umask(UMASK)
+FILEMODE = 0o666 & ~UMASK
+
+def parseChecksum(checksum):
+    """ (algorithm, hex digest) of a checksum written as algorithm:digest or as a bare hex
+        digest of an md5, sha1, sha256 or sha512. None if checksum is '-' """
+    if checksum in ('-', ''):
+        return None
+    if ':' in checksum:
+        algo, digest = checksum.split(':', 1)
+    else:
+        algo, digest = ALGORITHMS.get(len(checksum)), checksum
+    if algo is None or algo.lower() not in hashlib.algorithms_available:
+        raise Exception("unknown checksum '%s', use algorithm:hexdigest, e.g. sha256:..." % checksum)
+    return algo.lower(), digest.lower()
+
+def fileHashes(path, algos):
+    """ hex digests of the contents of path for each algorithm in algos """
+    hashes = dict([(a, hashlib.new(a)) for a in algos])
+    with open(path, 'rb') as f:
+        block = f.read(BLOCKSIZE)
+        while block:
+            for h in hashes.values():
+                h.update(block)
+            block = f.read(BLOCKSIZE)
+    return dict([(a, hashes[a].hexdigest()) for a in hashes])
+
+def verify(path, checksum):
+    """ True if the contents of path match checksum, a parseChecksum result or None """
+    if checksum is None:
+        return True
+    algo, digest = checksum
+    return fileHashes(path, [algo])[algo] == digest
+
+def publish(tmpname, dest):
+    """ Rename tmpname, made by mkstemp and so only readable by the owner, to dest with FILEMODE """
+    os.chmod(tmpname, FILEMODE)
+    os.rename(tmpname, dest)
+
+def linkOrCopy(src, dest):
+    """ Make dest a hard link of src, a copy if src is on another file system. dest is
+        replaced at once, never seen half written """
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(dest) or '.', prefix='.fetch-')
+    os.close(fd)
+    os.remove(tmpname)
+    try:
+        os.link(src, tmpname)
+    except OSError:
+        shutil.copyfile(src, tmpname)
+    os.rename(tmpname, dest)
+
+class sourceCache(object):
+    """ Content addressed cache of source files, shared by all admixes.
+        sha256/<digest> are the files, urls/<sha256 of key> the digest of the file last
+        stored for a key: the URL the file was fetched from, or its name if it has no URL """
+
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+        for d in ('sha256', 'urls'):
+            path = os.path.join(cachedir, d)
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # made by another fetcher at the same time
+                    if not os.path.isdir(path):
+                        raise
+
+    @staticmethod
+    def defaultDir():
+        """ YAML2RPM_SOURCES_CACHE if set, otherwise yaml2rpm-sources/ in the user cache directory.
+            Returns None if the cache is turned off with YAML2RPM_SOURCES_CACHE=off """
+        cachedir = os.environ.get('YAML2RPM_SOURCES_CACHE')
+        if cachedir is not None:
+            if cachedir.lower() in ("", "off", "no", "none"):
+                return None
+            return cachedir
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        return os.path.join(base, 'yaml2rpm-sources')
+
+    def blob(self, digest):
+        return os.path.join(self.cachedir, 'sha256', digest)
+
+    def keyEntry(self, key):
+        return os.path.join(self.cachedir, 'urls', hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def valid(self, path, checksum):
+        """ True if the blob path matches checksum and the sha256 it is stored under. A blob is a
+            hard link of files in sources directories, one rewritten in place changes the blob
+            too: such a blob is removed """
+        algos = ['sha256']
+        if checksum is not None and checksum[0] != 'sha256':
+            algos.append(checksum[0])
+        hashes = fileHashes(path, algos)
+        if hashes['sha256'] != os.path.basename(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return False
+        return checksum is None or hashes[checksum[0]] == checksum[1]
+
+    def find(self, key, checksum):
+        """ The cached file with checksum, or stored last for key. None if there is none """
+        candidates = []
+        if checksum is not None and checksum[0] == 'sha256':
+            candidates.append(self.blob(checksum[1]))
+        try:
+            with open(self.keyEntry(key), 'r') as f:
+                candidates.append(self.blob(f.read().strip()))
+        except (IOError, OSError):
+            pass
+        for path in candidates:
+            if os.path.isfile(path) and self.valid(path, checksum):
+                return path
+        return None
+
+    def add(self, path, key):
+        """ Store the file path for key and return its cached path """
+        digest = fileHashes(path, ['sha256'])['sha256']
+        blob = self.blob(digest)
+        if not os.path.isfile(blob) or not (os.path.samefile(path, blob) or self.valid(blob, None)):
+            linkOrCopy(path, blob)
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(self.keyEntry(key)))
+        with os.fdopen(fd, 'w') as f:
+            f.write(digest + "\n")
+        publish(tmpname, self.keyEntry(key))
+        return blob
+
+class sourceFetcher(object):
+    """ Puts the source files in the sources directory, from the sources directory itself,
+        the cache, the URL or the mirror, in that order """
+
+    def __init__(self, sources, cache=None, offline=False, mirror=None, timeout=60):
+        self.sources = sources
+        self.cache = cache
+        self.offline = offline
+        self.mirror = mirror
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.failed = []
+
+    def report(self, msg, error=False):
+        with self.lock:
+            if error:
+                sys.stderr.write(msg + "\n")
+            else:
+                sys.stdout.write(msg + "\n")
+                sys.stdout.flush()
+
+    def urls(self, fname, url):
+        """ URLs to try for fname in order """
+        urls = []
+        if url is not None:
+            urls.append(url)
+        if self.mirror is not None:
+            urls.append("%s/%s" % (self.mirror.rstrip('/'), fname))
+        return urls
+
+    def download(self, url, dest):
+        """ Download url into dest, through a temporary file next to it """
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(dest) or '.', prefix='.fetch-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                remote = urlopen(url, timeout=self.timeout)
+                try:
+                    block = remote.read(BLOCKSIZE)
+                    while block:
+                        f.write(block)
+                        block = remote.read(BLOCKSIZE)
+                finally:
+                    remote.close()
+            publish(tmpname, dest)
+        finally:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+
+    def fetch(self, spec, fname, url, checksum):
+        """ Put fname of spec in the sources directory. Returns a message, raises on failure """
+        dest = os.path.join(self.sources, fname)
+        key = url or fname
+        if os.path.isfile(dest):
+            if verify(dest, checksum):
+                if self.cache is not None:
+                    self.cache.add(dest, key)
+                return "%s: present" % fname
+            os.remove(dest)
+            self.report("%s: %s does not match its checksum, removed" % (spec, dest), True)
+        if self.cache is not None:
+            cached = self.cache.find(key, checksum)
+            if cached is not None:
+                linkOrCopy(cached, dest)
+                return "%s: from the cache" % fname
+        urls = self.urls(fname, url)
+        if not urls:
+            raise Exception("not in %s or the cache and has no URL" % self.sources)
+        if self.offline:
+            raise Exception("not in %s or the cache and offline" % self.sources)
+        errors = []
+        for u in urls:
+            try:
+                self.download(u, dest)
+            except Exception as ex:
+                errors.append("%s: %s" % (u, str(ex)))
+                continue
+            if not verify(dest, checksum):
+                os.remove(dest)
+                errors.append("%s: checksum mismatch" % u)
+                continue
+            if self.cache is not None:
+                self.cache.add(dest, key)
+            return "%s: downloaded from %s" % (fname, u)
+        raise Exception("; ".join(errors))
+
+    def worker(self, todo):
+        while True:
+            try:
+                entry = todo.get_nowait()
+            except queue.Empty:
+                return
+            spec, fname = entry[0], entry[1]
+            try:
+                self.report(self.fetch(*entry))
+            except Exception as ex:
+                with self.lock:
+                    self.failed.append(fname)
+                self.report("%s: %s: %s" % (spec, fname, str(ex)), True)
+
+    def run(self, entries, jobs):
+        """ Fetch entries, (spec, file, url, checksum) tuples, jobs at a time. Returns the
+            names of the files that could not be fetched """
+        todo = queue.Queue()
+        for entry in entries:
+            todo.put(entry)
+        workers = [threading.Thread(target=self.worker, args=(todo,)) for i in range(max(1, jobs))]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        return self.failed
+
+def readEntries(fnames, only=None):
+    """ (spec, file, url, checksum) of each line of the files fnames ('-' is stdin). url and
+        checksum are None if given as '-'. only is a list of spec names to keep """
+    entries = []
+    for fname in fnames:
+        if fname == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(fname, 'r') as f:
+                lines = f.read().splitlines()
+        for line in lines:
+            words = line.split()
+            if not words or words[0].startswith('#'):
+                continue
+            if len(words) != 4:
+                raise Exception("%s: expected 'spec file url checksum', got '%s'" % (fname, line))
+            spec, source, url, checksum = words
+            if only and spec not in only:
+                continue
+            entries.append((spec, source, None if url == '-' else url, parseChecksum(checksum)))
+    return entries
+
+## *****************************
+## main routine
+## *****************************
+
+def main(argv):
+
+    # description and help lines for the usage  help
+    description = "fetches the source files listed by gen-definitions.py --admix=sources into the\n"
+    description += "sources directory, several at once, and checks them against the checksum of the spec\n"
+
+    helpcache = "cache of source files shared by admixes, default is $YAML2RPM_SOURCES_CACHE or\n"
+    helpcache += "~/.cache/yaml2rpm-sources. 'off' turns the cache off"
+    helpoffline = "do not download, take files only from the sources directory and the cache"
+    helpmirror = "base URL tried for each file after its own URL, e.g. file:///share/sources"
+
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-s", "--sources", dest="sources", default="../sources", help="sources directory, default is ../sources")
+    parser.add_argument("-j", "--jobs",    dest="jobs",    default=4, type=int, help="number of files fetched at once, default is 4")
+    parser.add_argument("-c", "--cache",   dest="cache",   default=sourceCache.defaultDir(), help=helpcache)
+    parser.add_argument("-o", "--offline", dest="offline", default=False, action='store_true', help=helpoffline)
+    parser.add_argument("-m", "--mirror",  dest="mirror",  default=None, help=helpmirror)
+    parser.add_argument("-t", "--timeout", dest="timeout", default=60, type=int, help="network timeout in seconds, default is 60")
+    parser.add_argument("--only",          dest="only",    default=None, help="spec names, comma or space separated, to fetch the files of. Default is all")
+    # required positional argument
+    parser.add_argument("lists",  action="store", help="gen-definitions.py --admix=sources output, - is stdin", nargs='+')
+    args = parser.parse_args(argv)
+
+    only = args.only.replace(',', ' ').split() if args.only else None
+    entries = readEntries(args.lists, only)
+    if not os.path.isdir(args.sources):
+        os.makedirs(args.sources)
+    cache = None
+    if args.cache is not None and args.cache.lower() not in ("", "off", "no", "none"):
+        cache = sourceCache(args.cache)
+    fetcher = sourceFetcher(args.sources, cache, args.offline, args.mirror, args.timeout)
+    failed = fetcher.run(entries, args.jobs)
+    if failed:
+        sys.stderr.write("could not fetch: %s\n" % " ".join(failed))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,79 @@
+#!/bin/env python
+# Run a gen-definitions.py call in the gen-definitions.py server
+#
+# Takes the same arguments as gen-definitions.py and gives the same output and exit status.
+# The call is sent with the current directory and environment to the server started with
+# gen-definitions.py --server, which has python, ruamel, the include files and the defaults
+# already loaded. If no server is listening, or YAML2RPM_SERVER=off, gen-definitions.py is
+# run here instead. Only what is needed to talk to the server is imported.
+
+import os
+import sys
+
+GENDEFS = os.path.join(os.path.dirname(os.path.realpath(__file__)), "gen-definitions.py")
+
+def serverSocket():
+    """ Same as serverSocket of gen-definitions.py """
+    path = os.environ.get('YAML2RPM_SERVER')
+    if path:
+        return path
+    import tempfile
+    rundir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(rundir, "yaml2rpm-gen-%d.sock" % os.getuid())
+
+def runLocal(argv):
+    """ Replace this process by gen-definitions.py with argv """
+    sys.stdout.flush()
+    os.execv(sys.executable, [sys.executable, GENDEFS] + argv)
+
+def callServer(path,argv):
+    """ The reply of the server on path to the call argv, None if there is no server or the
+        call was not answered """
+    import json
+    import socket
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        request = { 'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ) }
+        s.sendall(json.dumps(request).encode('utf-8'))
+        s.shutdown(socket.SHUT_WR)
+        data = []
+        chunk = s.recv(65536)
+        while chunk:
+            data.append(chunk)
+            chunk = s.recv(65536)
+    except socket.error:
+        return None
+    finally:
+        s.close()
+    try:
+        reply = json.loads(b"".join(data).decode('utf-8'))
+    except ValueError:
+        return None
+    if reply.get('status') is None:
+        return None
+    return reply
+
+def write(stream,text):
+    if sys.version_info.major < 3:
+        text = text.encode('utf-8')
+    stream.write(text)
+    stream.flush()
+
+## *****************************
+## main routine
+## *****************************
+
+def main(argv):
+    path = serverSocket()
+    reply = None
+    if path.lower() not in ("off", "no", "none") and os.path.exists(path):
+        reply = callServer(path, argv)
+    if reply is None:
+        runLocal(argv)
+    write(sys.stderr, reply['stderr'])
+    write(sys.stdout, reply['stdout'])
+    sys.exit(reply['status'])
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
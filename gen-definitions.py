@@ -7,23 +7,257 @@
 #from builtins import object
 
 #import yaml
-import ruamel.yaml 
 #from pathlib2 import Path
 import re
 import sys
 import datetime
 import socket 
 import os
-import io
 import argparse
-import pdb
+import bisect
+import hashlib
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 if sys.version_info.major == 3:
-    from typing import Dict
+    from typing import Dict, Optional
 incMap = {} # type: Dict[str, str]
 
-yaml = ruamel.yaml.YAML(typ='safe', pure=True)
-yaml.default_flow_style = False
+# Every file tried while parsing: full path -> sha256 of its contents, None if it could not be read.
+# Used to validate the spec cache
+readFiles = {} # type: Dict[str, Optional[str]]
+
+# Every include name looked up while parsing: name -> the name incMap replaced it with, itself if
+# it is not mapped. Parsed files are shared by variants whose incMap agrees on these, see mapAgrees
+mapUses = {} # type: Dict[str, str]
+
+# Files written by --outdir and the queries recorded in QUERIES as (query, listSep) 
+DEFINITIONS = "Definitions.mk"
+MODULEFILE = "modulefile"
+QUERIES = "Queries.sh"
+EMIT_QUERIES = [("pretar",None),("patch",None),("tarball",None),("addfile"," "),("addsource"," ")]
+
+yaml = None
+
+class runTimer(object):
+    """ Wall time spent in the phases of one run, for --timings. Phases nest: the time of an
+        inner phase (e.g. include searching while parsing) is not counted for the outer one,
+        so the phases and 'other' add up to the run """
+    def __init__(self):
+        self.enabled = False
+        self.started = time.time()
+        self.totals = {}   # phase -> seconds
+        self.counts = {}   # phase -> times entered
+        self.stack = []    # [phase, time it was last resumed]
+
+    def begin(self,phase):
+        if not self.enabled:
+            return
+        now = time.time()
+        if self.stack:
+            outer = self.stack[-1]
+            self.totals[outer[0]] = self.totals.get(outer[0], 0.0) + now - outer[1]
+        self.stack.append([phase, now])
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def end(self):
+        if not self.enabled or not self.stack:
+            return
+        now = time.time()
+        phase, resumed = self.stack.pop()
+        self.totals[phase] = self.totals.get(phase, 0.0) + now - resumed
+        if self.stack:
+            self.stack[-1][1] = now
+
+    def timed(self,phase,func,*args):
+        """ Return func(*args), its time counted for phase """
+        self.begin(phase)
+        try:
+            return func(*args)
+        finally:
+            self.end()
+
+    def report(self,title):
+        """ lines of the breakdown of the run by phase, slowest first """
+        total = time.time() - self.started
+        other = total - sum(self.totals.values())
+        lines = ["%s: %.3fs" % (title, total)]
+        rows = sorted(self.totals.items(), key=lambda x: -x[1]) + [('other', other)]
+        for phase, seconds in rows:
+            count = self.counts.get(phase)
+            calls = "  (%d calls)" % count if count and count > 1 else ""
+            lines.append("  %-10s %8.3fs %5.1f%%%s" % (phase, seconds, seconds * 100.0 / (total or 1.0), calls))
+        return lines
+
+    def write(self,dest,title):
+        """ Write the report to stderr if dest is '-', otherwise append it to the file dest
+            in one write, reports of runs at the same time are not mixed """
+        text = "\n".join(self.report(title)) + "\n"
+        if dest == '-':
+            sys.stderr.write(text)
+            return
+        fd = os.open(dest, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, text.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+# phases of this run, enabled by --timings
+timer = runTimer()
+
+def getYaml():
+    """ Return the YAML loader. It is created on first use so that specs found 
+        in the spec cache do not pay for importing ruamel """
+    global yaml
+    if yaml is None:
+        yaml = timer.timed("loader", yamlLoader)
+    return yaml
+
+class yamlLoader(object):
+    """ Loads YAML documents with one of two parsers:
+           c     the libyaml based parser from ruamel.yaml.clib, used when it is installed
+           pure  the python parser of ruamel.yaml
+        YAML2RPM_LOADER=c|pure selects one. Both feed the same python composer and constructor,
+        so anchors are kept across documents and !include files with either parser """
+    BACKENDS = ['c', 'pure']
+
+    def __init__(self,backend=None):
+        import ruamel.yaml
+        if backend is None:
+            backend = yamlLoader.defaultBackend()
+        if backend not in yamlLoader.BACKENDS:
+            raise Exception("unknown YAML loader '%s', use one of: %s" % (backend, ", ".join(yamlLoader.BACKENDS)))
+        self.CParser = None
+        if backend == 'c':
+            try:
+                from _ruamel_yaml import CParser
+            except ImportError:
+                raise Exception("C loader requested but ruamel.yaml.clib is not installed")
+            self.CParser = CParser
+        self.backend = backend
+        self.yaml = ruamel.yaml.YAML(typ='safe', pure=True)
+        self.yaml.default_flow_style = False
+        self.yaml.Composer.compose_document = new_compose_document
+        self.yaml.Constructor.add_constructor("!include", new_yaml_include)
+        self.yaml.backend = backend   # for the loaders of nested !include files
+
+    @staticmethod
+    def defaultBackend():
+        backend = os.environ.get('YAML2RPM_LOADER', '')
+        if backend:
+            return backend
+        if yamlLoader.available('c'):
+            return 'c'
+        return 'pure'
+
+    @staticmethod
+    def available(backend):
+        """ True if the parser of backend can be imported """
+        if backend != 'c':
+            return True
+        try:
+            import _ruamel_yaml
+            return True
+        except ImportError:
+            return False
+
+    @property
+    def composer(self):
+        return self.yaml.composer
+
+    def load_all(self,stream):
+        """ Generator of the documents in stream """
+        if self.CParser is None:
+            for doc in self.yaml.load_all(stream):
+                yield doc
+            return
+        constructor = self.parse(stream)
+        try:
+            while constructor.check_data():
+                yield constructor.get_data()
+        finally:
+            self.dispose()
+
+    def load(self,stream):
+        """ The single document in stream """
+        if self.CParser is None:
+            return self.yaml.load(stream)
+        constructor = self.parse(stream)
+        try:
+            return constructor.get_single_data()
+        finally:
+            self.dispose()
+
+    def parse(self,stream):
+        """ Set the C parser as the source of events of the composer """
+        self.yaml._parser = self.CParser(stream)
+        return self.yaml.constructor
+
+    def dispose(self):
+        self.yaml._parser.dispose()
+        del self.yaml._parser
+
+def collectReadFiles(func,*args):
+    """ Call func(*args), return its result and the readFiles and mapUses entries recorded 
+        during the call. The entries are kept in readFiles and mapUses as well """
+    global readFiles, mapUses
+    outer, outerUses = readFiles, mapUses
+    readFiles, mapUses = {}, {}
+    try:
+        result = func(*args)
+        return result, readFiles, mapUses
+    finally:
+        outer.update(readFiles)
+        outerUses.update(mapUses)
+        readFiles, mapUses = outer, outerUses
+
+def mapInclude(filename):
+    """ The name of the file to include for filename, replaced if incMap maps it """
+    mapped = incMap.get(filename, filename)
+    mapUses[filename] = mapped
+    return mapped
+
+def mapAgrees(uses):
+    """ True if incMap replaces the include names in uses, a mapUses, the same way """
+    for name in uses:
+        if incMap.get(name, name) != uses[name]:
+            return False
+    return True
+
+def textDigest(text):
+    """ sha256 of the contents of a file read in text mode """
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.sha256(text).hexdigest()
+
+def statSignature(path):
+    """ (mtime, size, inode) of path, None if it does not exist. A changed signature means
+        the file was changed, replaced or removed """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size, st.st_ino)
+
+hostname = None
+
+def hostName():
+    """ The fully qualified name of this host, looked up once """
+    global hostname
+    if hostname is None:
+        hostname = socket.getfqdn()
+    return hostname
+
+def fileDigest(path):
+    """ sha256 of a file read in text mode, None if it cannot be read """
+    try:
+        with open(path, 'r') as f:
+            return textDigest(f.read())
+    except Exception:
+        return None
 
 def new_compose_document(self):
     self.parser.get_event()
@@ -32,30 +266,8 @@ def new_compose_document(self):
     return node
 
 def new_yaml_include(loader, node):
-    y = loader.loader
-    yaml = ruamel.yaml.YAML(typ=y.typ, pure=y.pure)  # same values as including YAML
-    yaml.composer.anchors = loader.composer.anchors
-    incPath = IncPath().getPath()
-    global incMap
-    filename = loader.construct_scalar(node)
-    if filename in list(incMap.keys()):
-        filename = incMap[filename]
-    for p in incPath:
-        try:
-            with open(os.path.join(p,filename), 'r') as f:
-                # FIXME return last line only
-                data = yaml.load(f)
-                #print ("=== FILE START:", f)
-                #yaml.dump(data, sys.stdout)
-                #print ("=== FILE END")
-                return data
-                #return yaml.load(f)
-        except:
-            pass
-    raise  Exception("%s not found in: %s" % (filename,str(incPath)))
-
-yaml.Composer.compose_document = new_compose_document
-yaml.Constructor.add_constructor("!include", new_yaml_include)
+    filename = mapInclude(loader.construct_scalar(node))
+    return getIncIndex().loadInclude(filename, loader)
 
 #class Loader(object):
 #    def __init__(self, stream):
@@ -92,75 +304,321 @@ class IncPath():
         return self.incPath
 
 
-class IncParser(io.FileIO):
-    """ This class handles !include directives to have a more natural 'include this
-            yaml file' and merge with keys """
-    def __init__(self,filename,mode='r'):
-        global incMap
-
-        if filename in list(incMap.keys()):
-            filename = incMap[filename]
-
-        self.incPath = IncPath().getPath()
-        self.filename = filename
-
-        # now go the incPath looking for the file
-        for p in self.incPath:
+class IncludeNotFound(Exception):
+    """ A file could not be found in any directory of the include path """
+    pass
+
+class textStream(object):
+    """ Minimal read-only file object over a string. name is used by the YAML
+        parser in error messages """
+    def __init__(self,text,name):
+        self.text = text
+        self.name = name
+        self.pos = 0
+
+    def read(self,size=-1):
+        if size is None or size < 0:
+            size = len(self.text) - self.pos
+        chunk = self.text[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+def splitLines(text):
+    """ split text into lines that keep their newline, like iterating over a file """
+    lines = [l + '\n' for l in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+class IncIndex(object):
+    """ Search index for the include path, shared by IncParser and the !include 
+        constructor. Each directory is listed once, each file is read once and each 
+        !include file is parsed once per process """
+    def __init__(self,incPath):
+        self.incPath = incPath
+        self.dirs = {}      # directory -> names it contains
+        self.texts = {}     # full path -> file contents
+        self.digests = {}   # full path -> sha256 of the contents
+        self.docs = {}      # full path -> (data, anchors defined, files tried, mapUses) of a parsed !include file
+        self.loaders = []   # yamlLoaders for nested !include, by nesting depth
+        self.stats = {}     # full path or directory -> statSignature when it was read or listed
+
+    def listing(self,dirname):
+        """ names in dirname, an empty set if it cannot be listed """
+        if dirname not in self.dirs:
+            self.stats[dirname] = statSignature(dirname)
             try:
+                self.dirs[dirname] = set(os.listdir(dirname))
+            except OSError:
+                self.dirs[dirname] = set()
+        return self.dirs[dirname]
+
+    def exists(self,dirname,filename):
+        fullpath = os.path.join(dirname,filename)
+        if os.path.dirname(filename):
+            # a path rather than a plain name, cannot use the directory listing
+            return os.path.isfile(fullpath)
+        return filename in self.listing(dirname) and os.path.isfile(fullpath)
+
+    def find(self,filename):
+        """ Return the full path of the first filename in the include path """
+        timer.begin("include")
+        try:
+            for p in self.incPath:
                 fullpath = os.path.join(p,filename)
-                super(IncParser,self).__init__(fullpath,mode)
+                if self.exists(p,filename):
+                    return fullpath
+                readFiles.setdefault(fullpath, None)
+        finally:
+            timer.end()
+        raise IncludeNotFound("%s not found in: %s" % (filename,str(self.incPath)))
+
+    def read(self,fullpath):
+        """ contents of fullpath. Read errors are raised """
+        if fullpath not in self.texts:
+            timer.begin("include")
+            try:
+                self.stats[fullpath] = statSignature(fullpath)
                 with open(fullpath, 'r') as f:
-                    self.items = [l for l in f]
-                    # pdb.set_trace()         
-                    self.iter = iter(self.items)
-                    self.child = []
-                    return
-            except:
-                pass
-        raise  Exception("%s not found in: %s" % (filename,str(self.incPath)))
-
-    # We are including files, so we need to go to the current include file, which may be 
-    # several layers deep. Find the correct lines to iterate through
-    def getIter(self):
-        if not self.child:
-           return self.iter
-        else:
-           return self.child[0].getIter()
-
-    def read(self,size):
-        # Called by the YAML parser, it is supposed to return lines of valid YAML or comments
-        # since we have includes, this is more complicated.
+                    text = f.read()
+                self.digests[fullpath] = textDigest(text)
+                self.texts[fullpath] = text
+            finally:
+                timer.end()
+        readFiles[fullpath] = self.digests[fullpath]
+        return self.texts[fullpath]
+
+    def revalidate(self):
+        """ Forget the listings of directories and the contents of files that changed on disk
+            since they were read, and the parsed !include files that read any of them or that
+            looked for a file that now exists (it comes earlier in the include path than the
+            one they read). Used by the server, where the index is kept between calls """
+        stale = set([p for p in self.stats if statSignature(p) != self.stats[p]])
+        for p in stale:
+            del self.stats[p]
+            for d in (self.dirs, self.texts, self.digests):
+                d.pop(p, None)
+        for fullpath in list(self.docs):
+            files = self.docs[fullpath][2]
+            for p in files:
+                if files[p] is None:
+                    changed = os.path.dirname(p) in stale or statSignature(p) is not None
+                else:
+                    changed = p in stale or p not in self.texts
+                if changed:
+                    del self.docs[fullpath]
+                    break
+
+    def loadInclude(self,filename,loader):
+        """ Parse the !include file filename with the anchors of the including document.
+            Anchors defined in the included file become visible to the including document.
+            A file that uses no anchors of the including document is only parsed once, and again
+            for an incMap that replaces a file it includes differently """
+        (data, defined), files, uses = collectReadFiles(self.parseInclude, filename, loader)
+        loader.composer.anchors.update(defined)
+        return data
+
+    def parseInclude(self,filename,loader):
+        """ Returns the data of the !include file filename and the anchors it defines """
+        from ruamel.yaml.composer import ComposerError
+        fullpath = self.find(filename)
+        if fullpath in self.docs and mapAgrees(self.docs[fullpath][3]):
+            data, defined, files, uses = self.docs[fullpath]
+            readFiles.update(files)
+            mapUses.update(uses)
+            return data, defined
+        text = self.read(fullpath)
+        y = timer.timed("loader", self.includeLoader, loader.loader.backend)
         try:
-            line = next(self.getIter())
+            y.composer.anchors = {}
+            data = y.load(textStream(text,fullpath))
+        except ComposerError:
+            # refers to anchors of the including document, parse in its context
+            y.composer.anchors = loader.composer.anchors
+            return y.load(textStream(text,fullpath)), {}
+        finally:
+            self.loaders.append(y)
+        defined = y.composer.anchors
+        self.docs[fullpath] = (data, defined, dict(readFiles), dict(mapUses))
+        return data, defined
+
+    def includeLoader(self,backend):
+        """ a loader with the given backend that is not in use. !include files can nest """
+        if self.loaders and self.loaders[-1].backend == backend:
+            return self.loaders.pop()
+        return yamlLoader(backend)
+
+incIndex = None
+
+def getIncIndex():
+    """ The include index of this process """
+    global incIndex
+    if incIndex is None:
+        incIndex = IncIndex(IncPath().getPath())
+    return incIndex
+
+
+class IncParser(object):
+    """ This class handles !include directives to have a more natural 'include this
+            yaml file' and merge with keys. It is a read-only file object for the YAML 
+            parser: lines that start with !include are replaced by the lines of the included
+            file, which can include further files. Errors in the YAML are mapped back to 
+            the file and line they came from with fixMarks """
+    def __init__(self,filename):
+        filename = mapInclude(filename)
+
+        self.index = getIncIndex()
+        self.incPath = self.index.incPath
+        self.filename = filename
+
+        # now go the incPath looking for the file, it is read and closed right away
+        self.name = self.index.find(filename)
+        self.index.read(self.name)
+        self.lines = self.expand()
+        self.pending = ""
+        # line map: output line -> (file, line), one entry each time the source file changes
+        self.outLine = 0
+        self.mapStarts = []
+        self.mapFiles = []
+
+    def mapLine(self,fullpath,line):
+        """ output lines from now on come from fullpath, starting at line """
+        self.mapStarts.append(self.outLine)
+        self.mapFiles.append((fullpath,line))
+
+    def expand(self):
+        """ Generator of the lines of the file with !include lines replaced by the lines of the included file.
+            Included files are handled with a stack of (file, lines, next line), not recursion """
+        stack = [[self.name, splitLines(self.index.read(self.name)), 0]]
+        self.mapLine(self.name,0)
+        while stack:
+            top = stack[-1]
+            fullpath, lines, pos = top
+            if pos == len(lines):
+                # end of an included file, continue with the next line of the including file
+                stack.pop()
+                if stack:
+                    self.mapLine(stack[-1][0], stack[-1][2])
+                continue
+            line = lines[pos]
+            top[2] = pos + 1
             # we need to NOT return text that says !include to the YAML parser, but only the included
             # text. In other words, parse the included file, but don't return !include
             if line.startswith("!include"):
-                incName = line.split()[1]
-                self.child.insert(0,IncParser(incName))
-                return self.read(size)
-            return line 
-        except StopIteration:
-            if not self.child:
-                return ""
-            # We reached the end of the current file that we were reading. go up one level and read the
-            # the next line of that file 
-            self.child.pop(0)
-            return self.read(size)
+                incName = mapInclude(line.split()[1])
+                incPath = self.index.find(incName)
+                stack.append([incPath, splitLines(self.index.read(incPath)), 0])
+                self.mapLine(incPath,0)
+                continue
+            if line.endswith('\n'):
+                self.outLine += 1
+            yield line
+
+    def read(self,size=-1):
+        """ Called by the YAML parser, return up to size characters, "" at the end """
+        parts = [self.pending]
+        length = len(self.pending)
+        while size is None or size < 0 or length < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            parts.append(line)
+            length += len(line)
+        buf = "".join(parts)
+        if size is not None and 0 <= size < len(buf):
+            self.pending = buf[size:]
+            buf = buf[:size]
+        else:
+            self.pending = ""
+        return buf
+
+    def fileMark(self,mark):
+        """ The mark in the file and line that output line mark.line came from """
+        from ruamel.yaml.error import FileMark
+        i = bisect.bisect_right(self.mapStarts, mark.line) - 1
+        fullpath, start = self.mapFiles[i]
+        line = start + mark.line - self.mapStarts[i]
+        index = sum([len(l) for l in splitLines(self.index.read(fullpath))[:line]]) + mark.column
+        return FileMark(fullpath, index, line, mark.column)
+
+    def fixMarks(self,ex):
+        """ Point the marks of YAML error ex at the included files instead of the spliced text """
+        for attr in ['context_mark', 'problem_mark']:
+            mark = getattr(ex, attr, None)
+            if mark is not None and mark.name == self.name and self.mapStarts:
+                setattr(ex, attr, self.fileMark(mark))
 
         
+class VariableError(Exception):
+    """ A {{ }} reference that can not be resolved: undefined or circular """
+    pass
+
+class lazyVars(dict):
+    """ The resolved variables of an mkParser, each resolved when it is first looked up
+        instead of all at once by resolveVars. For queries, that need only a few """
+    def __init__(self,mkp):
+        super(lazyVars,self).__init__()
+        self.mkp = mkp
+
+    def __missing__(self,v):
+        self.mkp.resolveVar(v, self.mkp.lookingUp or "query")
+        return dict.__getitem__(self, v)
+
+class varTemplate(object):
+    """ A string with {{ }} variables, split once into its literal text and variables.
+            segments   the literal strings and, for each variable, its (pattern, name) 
+            variables  the (pattern, name) of each variable in order, repeats included
+            braces     a literal has a '{' or '}': a new variable can form when the variables 
+                       are replaced """
+    __slots__ = ('segments', 'variables', 'braces')
+
+    def __init__(self,segments,variables,braces):
+        self.segments = segments
+        self.variables = variables
+        self.braces = braces
+
+    def splice(self,s,values):
+        """ s (the string of the template) with the variables in values, a list of 
+            (pattern, replacement), replaced. The same as replacing them in turn with 
+            str.replace, which is used for a single variable or when a brace could make 
+            the result differ """
+        if len(values) > 1 and not self.braces:
+            for var, v in values:
+                if '{' in v or '}' in v:
+                    break
+            else:
+                replace = dict(values)
+                return "".join([replace.get(x[0], x[0]) if type(x) is tuple else x for x in self.segments])
+        for var, v in values:
+            s = s.replace(var, v)
+        return s
+
 class mkParser(object):
     def __init__(self):
         self.varsdict = {}
+        self.varState = None     # (raw, deps, info) of the variables resolved so far, see resolveVar
+        self.lookingUp = None    # the key rLookup is resolving, for error messages
         self.varpat = re.compile('{{[A-Za-z0-9_\. ]+}}')
+        self.varsplit = re.compile('({{[A-Za-z0-9_\. ]+}})')
+        self.templates = {}      # string -> its varTemplate, None if it has no variables
+        self.expansions = {}     # (string, listSep) -> replaceVars of it with varsdict
+        self.expansionsOf = None # the varsdict the expansions were made with
         self.kvdict = None   
         self.defaults = None 
         self.combo = None 
+        self.keyIndex = None     # dotted key -> value in combo, see indexCombo
+        self.keyIndexOf = None   # the combo the index was built from
         self.incPath = IncPath().getPath()
 
     def readPkgYaml(self,fname):
         f = IncParser(fname)
-        docs = yaml.load_all(f)
-        self.kvdict = self.mergeDocs(docs) 
+        try:
+            docs = timer.timed("parse", list, getYaml().load_all(f))
+            self.kvdict = timer.timed("merge", self.mergeDocs, docs)
+        except Exception as ex:
+            f.fixMarks(ex)
+            raise
         self.combine()
     
     def readDefaultsYaml(self,fname):
@@ -169,12 +627,16 @@ class mkParser(object):
         for name in fnames: 
             try:
                 f = IncParser(name)
-                docs = yaml.load_all(f)
-                self.defaults = self.mergeDocs(docs)
-                self.combine()
-                return
-            except Exception as ex: 
-                pass
+            except IncludeNotFound: 
+                continue
+            try:
+                docs = timer.timed("parse", list, getYaml().load_all(f))
+                self.defaults = timer.timed("merge", self.mergeDocs, docs)
+            except Exception as ex:
+                f.fixMarks(ex)
+                raise
+            self.combine()
+            return
         raise Exception("Could not find defaults file in %s" % str(fnames))
 
     def mergeDocs(self,docs):
@@ -214,6 +676,35 @@ class mkParser(object):
         if self.defaults is not None and self.kvdict is not None:
             self.combo = self.defaults.copy()
             self.combo.update(self.kvdict)
+        self.keyIndex = None
+
+    def indexCombo(self):
+        """ Index every x.y.z reference that lookup can resolve in combo. Lists are
+            stored flattened. Nested dictionaries are walked by string keys; keys holding 
+            a '.', a quote or a backslash can not be reached that way, only a top level key 
+            with the full name. A nested x.y.z wins over a top level key 'x.y.z' """
+        index = {}
+        stack = [('', self.combo)]
+        while stack:
+            prefix, d = stack.pop()
+            for k in d:
+                if type(k) is not type("string") or '.' in k or "'" in k or '\\' in k:
+                    continue
+                val = d[k]
+                if type(val) is list:
+                    index[prefix + k] = self.flatten(val)
+                else:
+                    index[prefix + k] = val
+                    if type(val) is dict:
+                        stack.append((prefix + k + '.', val))
+        for k in self.combo:
+            if type(k) is type("string") and k not in index:
+                val = self.combo[k]
+                if type(val) is list:
+                    val = self.flatten(val)
+                index[k] = val
+        self.keyIndex = index
+        self.keyIndexOf = self.combo
 
     def lookup(self,e,ldict=None,stringify=True,listSep=None):
         """Looks up x.y.z references in multilevel dictionary
@@ -226,14 +717,22 @@ class mkParser(object):
 
         if ldict is None:
             ldict = self.combo
-        comps=e.split('.')
-        dkey = ["['%s']"%x for x in comps]
-        try:
-            val = eval("ldict%s"%"".join(dkey))
-        except:
-            val = ldict[e]
-        if type(val) is list: 
-            val = self.flatten(val)
+        if ldict is self.combo:
+            if self.keyIndex is None or self.keyIndexOf is not self.combo:
+                self.indexCombo()
+            val = self.keyIndex[e]
+            if type(val) is list:
+                val = list(val)
+        else:
+            val = ldict
+            for comp in e.split('.'):
+                if type(val) is dict and comp in val:
+                    val = val[comp]
+                else:
+                    val = ldict[e]
+                    break
+            if type(val) is list: 
+                val = self.flatten(val)
         if stringify:
             if listSep is not None:
                 return listSep.join(val)
@@ -249,6 +748,7 @@ class mkParser(object):
 
     def rLookup(self,e,stringify=True,listSep=None):
         """resolve lookups"""
+        self.lookingUp = e
         rhs = self.lookup(e,self.combo,stringify,listSep=listSep)
         if stringify:
             resolved = self.replaceVars(rhs,self.varsdict)
@@ -269,7 +769,6 @@ class mkParser(object):
                     Note: throws an exception if keyword does not exist """
 
         elems =  self.rLookup(keyword,stringify=False,listSep=listSep )
-        #pdb.set_trace()
         if type(elems) is list:
             rv = []
             for e in elems:
@@ -281,34 +780,97 @@ class mkParser(object):
             elems = joinString.join(rv) 
         return self.resolveStr(elems,listSep)
 
+    def compile(self,s):
+        """ The varTemplate of the string s, None if it has no vars {{ }}. Each string is 
+            only scanned once """
+        if '{{' not in s:
+            return None
+        template = self.templates.get(s, False)
+        if template is not False:
+            return template
+        # literals and variables alternate
+        segments = self.varsplit.split(s)
+        if len(segments) > 1:
+            variables = [(var, var[2:-2].strip()) for var in segments[1::2]]
+            segments[1::2] = variables
+            # each variable has two of each brace
+            braces = s.count('{') + s.count('}') > 4 * len(variables)
+            template = varTemplate(segments, variables, braces)
+        else:
+            template = None
+        self.templates[s] = template
+        return template
+
     def hasVars(self,s):
         """ determine if a string has vars {{ }} """
-        return len(re.findall(self.varpat,str(s))) > 0
+        if type(s) is type("string"):
+            return self.compile(s) is not None
+        return self.varpat.search(str(s)) is not None
 
     def varsInString(self,s):
         """ Return all the variable patterns in the supplied string """
+        if type(s) is type("string"):
+            template = self.compile(s)
+            return [var for var, name in template.variables] if template else []
         return re.findall(self.varpat,str(s))
 
     def extractVars(self,s):
         """ return a list of 'stripped' var names """
-        lvars = [x.replace('{{','').replace('}}','').strip() for x in re.findall(self.varpat,str(s))]
-        return lvars
+        if type(s) is type("string"):
+            template = self.compile(s)
+            return [name for var, name in template.variables] if template else []
+        return [x[2:-2].strip() for x in re.findall(self.varpat,str(s))]
+
+    def plainItems(self,l):
+        """ True if l is a list of strings without vars, replaceVars leaves it as it is """
+        for x in l:
+            if type(x) is not type("string") or self.compile(x) is not None:
+                return False
+        return True
 
     def replaceVars(self, src, vdict, listSep=None):
-        """ replace the vars in src with variables in a variables dict  """
+        """ replace the vars in src with variables in a variables dict. Strings are expanded
+            from their varTemplate, expansions with varsdict are kept until it is replaced """
         work = src
         if type(src) is not list:
             work = [ str(src) ]
+        memo = None
+        if vdict is self.varsdict:
+            if self.expansionsOf is not vdict:
+                self.expansions = {}
+                self.expansionsOf = vdict
+            memo = self.expansions
         rwork=[]
         for elem in work:
             if type(elem) is type("string"):
+                template = self.compile(elem)
+                if template is None:
+                    rwork.append(elem)
+                    continue
+                if memo is not None:
+                    expanded = memo.get((elem, listSep))
+                    if expanded is not None:
+                        if type(expanded) is tuple:
+                            rwork.extend(expanded)
+                        else:
+                            rwork.append(expanded)
+                        continue
+                values = []
                 newlist = []
-                for var in self.varsInString(elem):
-                    expand = self.vLookup(var,vdict,stringify=False)
+                plain = True    # newlist only has plain strings
+                for var, name in template.variables:
+                    expand = self.lookup(name,vdict,False)
                     if type(expand) is type("string"):
-                        elem = elem.replace(var,expand)
+                        values.append((var, expand))
+                    elif type(expand) is list and self.plainItems(expand):
+                        # list of plain strings, fans out as it is
+                        if listSep is None:
+                            newlist.extend(expand)
+                        else:
+                            values.append((var, listSep.join(expand)))
                     else:
                         # Variable expanded to another list, recurse
+                        plain = False
                         tmp = self.replaceVars(expand,vdict,listSep)
                         if listSep is None:
                             if type(tmp) is list:
@@ -317,13 +879,17 @@ class mkParser(object):
                                 newlist.extend([tmp])
                         else:
                             if type(tmp) is list:
-                                elem = elem.replace(var, listSep.join(tmp))
+                                values.append((var, listSep.join(tmp)))
                             else:
-                                elem = elem.replace(var, tmp)
+                                values.append((var, tmp))
                 if len(newlist) == 0:
-                    rwork.append(elem)
+                    expanded = template.splice(elem, values)
+                    rwork.append(expanded)
                 else:    
                     rwork.extend(newlist)
+                    expanded = tuple(newlist)
+                if memo is not None and plain:
+                    memo[(elem, listSep)] = expanded
             else:
                 tmp = self.replaceVars(elem,vdict,listSep)
                 rwork.append(tmp)
@@ -338,31 +904,132 @@ class mkParser(object):
 
     def resolveVars(self):
         """ Resolve all variables in the combo dictionary. As variables are 
-                    are resolved, the object varsdict will hold the resolved versions """
+                    are resolved, the object varsdict will hold the resolved versions.
+            The {{ }} references form a graph: each variable is resolved once, after
+            the variables it refers to. Undefined and circular references raise an
+            exception naming the chain of references """
+        self.varsdict = {}
+        self.varState = ({}, {}, {})
 
         # This loop finds all the vars that need to be replaced  in any definition
         for key in list(self.combo.keys()):
-            rhs = self.combo[key]
-            if self.hasVars(rhs):
-                for v in self.extractVars(rhs):
-                    self.setVar(self.varsdict,v,rhs)
-
+            for root in self.extractVars(self.combo[key]):
+                if root not in self.varsdict:
+                    self.resolveVar(root,key)
+
+    def lazyResolve(self):
+        """ Resolve variables only when they are looked up, see lazyVars """
+        self.varsdict = lazyVars(self)
+        self.varState = ({}, {}, {})
+
+    def resolveVar(self,root,key):
+        """ Resolve the variable root and the variables it refers to that are not resolved
+            yet. key is where root is referenced from, for error messages """
+        raw, deps, info = self.varState   # unresolved values, references and expansions, see finishVar
+        # depth first walk of the references, path is the current chain
+        path = [root]
+        onPath = set(path)
+        stack = [iter(self.varDeps(root,raw,deps,key,path))]
+        while stack:
+            try:
+                v = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                done = path.pop()
+                onPath.discard(done)
+                self.finishVar(done,raw,deps,info)
+                continue
+            if v in self.varsdict:
+                continue
+            if v in onPath:
+                chain = path[path.index(v):] + [v]
+                raise VariableError("circular variable reference: %s" % 
+                    " -> ".join(["{{%s}}" % x for x in chain]))
+            path.append(v)
+            onPath.add(v)
+            stack.append(iter(self.varDeps(v,raw,deps,key,path)))
+
+    def varDeps(self,v,raw,deps,key,path):
+        """ Look up the unresolved value of variable v and return the variables it refers to.
+            key and path describe where v was referenced from """
+        try:
+            raw[v] = self.lookup(v,self.combo,False)
+        except Exception:
+            raise VariableError("undefined variable {{%s}} referenced from: %s" % 
+                (v, " -> ".join([key] + ["{{%s}}" % x for x in path])))
+        deps[v] = []
+        for d in self.extractVars(raw[v]):
+            if d not in deps[v]:
+                deps[v].append(d)
+        return deps[v]
+
+    def finishVar(self,v,raw,deps,info):
+        """ Resolve v, all the variables it refers to are already resolved, and record
+            how v expands inside other values:
+               ('text', s)   string that only refers to other 'text' variables: s is fully resolved
+               ('str', s)    any other string: s is unresolved, it is spliced in and expanded 
+                             with the text around it
+               ('items', l)  not a string: the element referring to v is replaced by the items l """
+        rhs = raw[v]
+        if self.hasVars(rhs):
+            resolved = self.expandValue(rhs,info)
+        else:
+            resolved = rhs
+        self.varsdict[v] = resolved
+        if type(rhs) is type("string"):
+            if all([info[d][0] == 'text' for d in deps[v]]):
+                info[v] = ('text', resolved)
+            else:
+                info[v] = ('str', rhs)
+        else:
+            info[v] = ('items', self.replaceVars(resolved,{}))
 
-        # Do an initial pass of setting key-value pairs
-        # Do NOT Stringify at this point
-        for v in list(self.varsdict.keys()):
-            self.setVar(self.varsdict,v,self.lookup(v,self.combo,False))
+    def expandValue(self,src,info):
+        """ Fully expand the variables in src, the same as applying replaceVars
+            until no variables are left """
+        work = src
+        if type(src) is not list:
+            work = [ str(src) ]
+        rwork = []
+        for elem in work:
+            if type(elem) is type("string"):
+                expanded = self.expandElem(elem,info)
+                if type(expanded) is list:
+                    rwork.extend(expanded)
+                else:
+                    rwork.append(expanded)
+            else:
+                rwork.append(self.expandValue(elem,info))
+        if len(rwork) == 1:
+            return rwork[0]
+        else:
+            return rwork
 
+    def expandElem(self,elem,info):
+        """ Expand a string one level of variables at a time. Strings are spliced in,
+            the first level that refers to a variable that is not a string replaces 
+            elem with the items of those variables """
         while True:
-            changed = 0
-            for v in list(self.varsdict.keys()):
-                if self.hasVars(self.varsdict[v]):
-                    rhs = self.replaceVars(self.varsdict[v],self.combo)
-                    self.varsdict[v] = rhs
-                    changed = 1
-            if changed == 0:
-                break
-
+            template = self.compile(elem)
+            if template is None:
+                return elem
+            newlist = None
+            values = []
+            for var, name in template.variables:
+                kind, expand = info[name]
+                if kind == 'items':
+                    # an empty list leaves nothing, elem is dropped
+                    if newlist is None:
+                        newlist = []
+                    if type(expand) is list:
+                        newlist.extend(expand)
+                    else:
+                        newlist.extend([expand])
+                else:
+                    values.append((var, expand))
+            if newlist is not None:
+                return newlist
+            elem = template.splice(elem, values)
 
     def flatten(self, mllist):
         """ recursive method to flatten list of elements where each element
@@ -377,6 +1044,66 @@ class mkParser(object):
             literals.extend(self.flatten([val for sub in sublists for val in sub]))
             return literals
 
+class specCache(object):
+    """ Persistent cache of parsed and resolved specs. An entry is found by the spec name, 
+        current directory, YAML2RPM_INC, --map and defaults settings. It is only used if 
+        every file tried while parsing (the spec, line includes, !include files and the 
+        defaults file) still has the same contents, or is still unreadable. An entry stored
+        after a lazy load (see lazyVars) has the parsed state only """
+
+    def __init__(self,yamlfile,dflts_file,skipDefaults,cachedir=None):
+        if cachedir is None:
+            cachedir = specCache.defaultDir()
+        self.cachedir = cachedir
+        key = [ sys.version_info[:2], fileDigest(os.path.abspath(__file__)), os.getcwd(),
+                yamlfile, dflts_file, skipDefaults, os.environ.get('YAML2RPM_INC'),
+                sorted(incMap.items()) ]
+        self.entry = os.path.join(cachedir, textDigest(repr(key)) + ".pickle")
+
+    @staticmethod
+    def defaultDir():
+        """ YAML2RPM_CACHE if set, otherwise yaml2rpm/ in the user cache directory. 
+            Returns None if caching is turned off with YAML2RPM_CACHE=off """
+        cachedir = os.environ.get('YAML2RPM_CACHE')
+        if cachedir is not None:
+            if cachedir.lower() in ("", "off", "no", "none"):
+                return None
+            return cachedir
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        return os.path.join(base, 'yaml2rpm')
+
+    def load(self,mkp):
+        """ Fill mkp from the cache. Returns False if there is no valid entry. mkp.varsdict
+            is None if the entry has no resolved variables """
+        try:
+            with open(self.entry, 'rb') as f:
+                files, state = pickle.load(f)
+        except Exception:
+            return False
+        for path in files:
+            if fileDigest(path) != files[path]:
+                return False
+        readFiles.update(files)
+        mkp.kvdict, mkp.defaults, mkp.combo, mkp.varsdict = state
+        return True
+
+    def store(self,mkp):
+        """ Save the parsed and resolved state of mkp. Failures are not fatal """
+        import tempfile
+        varsdict = mkp.varsdict
+        if isinstance(varsdict, lazyVars):
+            varsdict = None
+        state = (mkp.kvdict, mkp.defaults, mkp.combo, varsdict)
+        try:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            fd, tmpname = tempfile.mkstemp(dir=self.cachedir)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((readFiles, state), f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpname, self.entry)
+        except Exception:
+            pass
+
 class moduleGenerator(object):
     def __init__(self,mkp):
         """ mkp is an mkParser, already initialized """
@@ -425,7 +1152,7 @@ class moduleGenerator(object):
 ##
 source /opt/rcic/include/rcic-module-head.tcl
 """ 
-        rstr = profile % (str(datetime.date.today()),socket.getfqdn())    
+        rstr = profile % (str(datetime.date.today()),hostName())    
         return rstr
 
 
@@ -463,7 +1190,6 @@ source /opt/rcic/include/rcic-module-tail.tcl
         if self.prereqModules:
             rstr += self.genMultiLine('module-whatis "Load modules___ %s"\n', self.prereqModules)
         if self.reqs:
-            #print ("DEBUG3", type(self.reqs), self.reqs)
             rstr += self.genMultiLine('module-whatis "Prerequisites__ %s"\n', self.reqs)
         rstr += '\n'
         return rstr
@@ -607,6 +1333,8 @@ class makeIncludeGenerator(object):
         options.extend([ ("PRECONFIGURE", "build.preconfigure","echo no preconfigure required")])
         options.extend([ ("BUILDTARGET", "build.target")])
         options.extend([ ("PKGMAKE", "build.pkgmake")])
+        options.extend([ ("CCACHE", "build.ccache")])
+        options.extend([ ("PARALLEL", "build.parallel")])
         options.extend([ ("MAKEINSTALL", "install.makeinstall")])
         options.extend([ ("INSTALLEXTRA", "install.installextra")])
         options.extend([ ("MODULENAME", "module.name","")])
@@ -697,7 +1425,10 @@ class queryProcessor(object):
         """ mkp is an mkParser, already initialized """
         self.mk = mkp
 
-    def processQuery(self,query,quiet=False,listSep=None):
+    def query(self,query,listSep=None):
+        """ Return the resolved value of a query. Throws an exception if the
+            queried keyword does not exist. A VariableError (only raised here when the
+            variables are resolved lazily) is never taken for a missing keyword """
         rq = query.strip().lower()
         if rq == "patch":
             rq = "build.patchfile"
@@ -707,21 +1438,56 @@ class queryProcessor(object):
         if rq == "tarball":
             try: 
                rstr = self.mk.rLookup("src_tarball")
+            except VariableError:
+               raise
             except:
                rstr = self.mk.rLookup("name")
                rstr += "-%s" % str(self.mk.rLookup("version"))
                rstr += ".%s" % self.mk.rLookup("extension")
-            print(rstr)
-            sys.exit(0)
+            return rstr
         if rq == "pkgname":
             try:
                 rstr = self.mk.rLookup("pkgname")
+            except VariableError:
+                raise
             except:
                 rstr = "%s_%s" % (self.mk.rLookup("name"), self.mk.rLookup("version")) 
-            print(rstr)
+            return rstr
+        return self.mk.lookupAndResolve(rq,listSep,listSep=listSep)
+
+    def quietQuery(self,query,listSep=None):
+        """ Return what processQuery prints in quiet mode: an empty string if the
+            keyword does not exist or resolves to nothing """
+        try:
+            rval = self.query(query,listSep)
+        except:
+            return ""
+        return str(rval)
+
+    def queryOutput(self,query,listSep=None):
+        """ Return what processQuery prints when not quiet: 'False' if the keyword does not
+            exist, 'True' if it resolves to nothing. Exceptions from tarball and pkgname
+            queries are raised """
+        rq = query.strip().lower()
+        if rq in ("tarball", "pkgname"):
+            return str(self.query(query,listSep))
+        try:
+            rval = self.query(query,listSep)
+        except:
+            return 'False'
+        if len(rval) > 0:
+            return str(rval)
+        return 'True'
+
+    def processQuery(self,query,quiet=False,listSep=None):
+        rq = query.strip().lower()
+        if rq in ("tarball", "pkgname"):
+            print(self.query(query,listSep))
             sys.exit(0)
         try:
-            rval = self.mk.lookupAndResolve(rq,listSep,listSep=listSep)
+            rval = self.query(query,listSep)
+        except VariableError:
+            raise
         except:
             if not quiet:
                 print('False')
@@ -732,12 +1498,798 @@ class queryProcessor(object):
         elif not quiet:
             print('True')
 
+def shellQuote(s):
+    """ quote a string for safe use as a single word in /bin/sh """
+    return "'%s'" % s.replace("'", "'\\''")
+
+def emitAll(mkp,outdir):
+    """ Write Definitions.mk, modulefile and the answers to the queries needed
+        to stage a build (see EMIT_QUERIES) into outdir, from a single parse.
+        Queries are written as shell variable assignments with --quiet semantics:
+        missing keywords are empty strings """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    mig = makeIncludeGenerator(mkp)
+    with open(os.path.join(outdir,DEFINITIONS), 'w') as f:
+        f.write(mig.generate() + "\n")
+
+    # module file is optional, an error here should not stop the build
+    try:
+        modfile = moduleGenerator(mkp).generate() + "\n"
+    except Exception as ex:
+        sys.stderr.write("could not generate %s: %s\n" % (MODULEFILE, str(ex)))
+        modfile = ""
+    with open(os.path.join(outdir,MODULEFILE), 'w') as f:
+        f.write(modfile)
+
+    qp = queryProcessor(mkp)
+    with open(os.path.join(outdir,QUERIES), 'w') as f:
+        f.write("# generated by gen-definitions.py, source with /bin/sh\n")
+        for query,listSep in EMIT_QUERIES:
+            f.write("%s=%s\n" % (query, shellQuote(qp.quietQuery(query,listSep))))
+
+def makeQuote(path):
+    """ path as a word in a makefile rule """
+    return path.replace('$', '$$').replace(' ', '\\ ').replace('#', '\\#')
+
+def depFiles(mkp,sources):
+    """ The files a package build depends on that exist: every file read while parsing the
+        spec (the spec, line includes, !include files and the defaults file) and the patch, 
+        addfile and the tarball and addsource files in the sources directory """
+    qp = queryProcessor(mkp)
+    paths = [p for p in sorted(readFiles) if readFiles[p] is not None]
+    paths.extend(qp.quietQuery("patch").split())
+    paths.extend(qp.quietQuery("addfile"," ").split())
+    paths.extend([os.path.join(sources,x) for x in qp.quietQuery("tarball").split()])
+    paths.extend([os.path.join(sources,x) for x in qp.quietQuery("addsource"," ").split()])
+    files = []
+    for p in paths:
+        p = os.path.normpath(p)
+        if p not in files and os.path.isfile(p):
+            files.append(p)
+    return files
+
+def writeDepfile(mkp,depfile,target,sources):
+    """ Write a gcc style depfile: target depends on depFiles, each of which has an empty
+        rule so that make does not stop when one of them is removed """
+    dirname = os.path.dirname(depfile)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    files = [makeQuote(p) for p in depFiles(mkp,sources)]
+    lines = ["%s: %s" % (makeQuote(target), " \\\n  ".join(files)), ""]
+    for p in files:
+        lines.extend(["%s:" % p, ""])
+    with open(depfile, 'w') as f:
+        f.write("\n".join(lines))
+
+def parseDefaults(dflts_file):
+    """ Parse the defaults file on its own, with a new loader. Returns the parsed defaults,
+        the files read for them and their mapUses, None if the defaults file refers to anchors
+        it does not define: it depends on the spec then and is parsed with each spec """
+    global yaml
+    from ruamel.yaml.composer import ComposerError
+    saved, yaml = yaml, None
+    mkp = mkParser()
+    try:
+        ignore, files, uses = collectReadFiles(mkp.readDefaultsYaml, dflts_file)
+    except ComposerError:
+        return None
+    finally:
+        yaml = saved
+    return mkp.defaults, files, uses
+
+class defaultsCache(object):
+    """ Defaults files parsed by the server, kept between calls, or for the variants of a
+        spec. An entry is used while none of the files read for it has changed on disk and
+        incMap replaces the files it includes the same way """
+    def __init__(self):
+        self.entries = {}   # key -> (parseDefaults result, statSignature of each file read)
+
+    def get(self,dflts_file):
+        """ parseDefaults(dflts_file), None if the defaults can not be shared """
+        key = repr((os.getcwd(), dflts_file, os.environ.get('YAML2RPM_INC'), 
+                    yamlLoader.defaultBackend()))
+        if key in self.entries:
+            parsed, signatures = self.entries[key]
+            if mapAgrees(parsed[2]) and not [p for p in signatures if statSignature(p) != signatures[p]]:
+                return parsed
+        parsed = parseDefaults(dflts_file)
+        if parsed is not None:
+            self.entries[key] = (parsed, dict([(p, statSignature(p)) for p in parsed[1]]))
+        return parsed
+
+# defaults files kept between calls by the server, None when not a server
+warmDefaults = None
+
+def loadSpec(yamlfile,dflts_file,skipDefaults,useCache=True,defaults=None,lazy=False):
+    """ Return an mkParser with yamlfile and the defaults file parsed and variables resolved,
+        from the spec cache when possible. defaults is a parseDefaults result, see 
+        admixProcessor. With lazy, variables are resolved when
+        they are looked up (see lazyVars), for a query that needs a few of them """
+    mkP = mkParser()
+    cache = None
+    if useCache and specCache.defaultDir() is not None:
+        cache = specCache(yamlfile, dflts_file, skipDefaults)
+    loaded = cache is not None and timer.timed("cache", cache.load, mkP)
+    if not loaded:
+        mkP.readPkgYaml(yamlfile)
+        if not skipDefaults:
+            if defaults is None and warmDefaults is not None:
+                defaults = warmDefaults.get(dflts_file)
+            if defaults is None:
+                mkP.readDefaultsYaml(dflts_file)
+            else:
+                mkP.defaults, files, uses = defaults
+                readFiles.update(files)
+                mapUses.update(uses)
+                mkP.combine()
+        mkP.varsdict = None
+    if mkP.varsdict is None:
+        if lazy:
+            mkP.lazyResolve()
+        else:
+            timer.timed("resolve", mkP.resolveVars)
+        if cache is not None and (not loaded or not lazy):
+            timer.timed("cache", cache.store, mkP)
+    return mkP
+
+class admixProcessor(object):
+    """ Answers for a whole admix what the manifest, module-provides, module-requires and 
+        admix-bootstrap-yaml targets of yamlspecs/Makefile used to compute with one or two
+        gen-definitions.py calls per package, the build dependencies between its packages and
+        the source files to fetch. The package lists are read from packages.yaml,
+        or from the modules.bootstrap, modules.system, modules.build and modules.manifest files 
+        of a directory, unless the lists are given (as yamlspecs/Makefile resolved them, see 
+        LISTS). Every spec is parsed once and the defaults file once for all specs """
+    OUTPUTS = ['manifest', 'module-provides', 'module-requires', 'bootstrap-yaml', 'pkgdeps', 'sources']
+    MODULE_FILES = ['modules.bootstrap', 'modules.system', 'modules.build', 'modules.manifest']
+    LISTS = ['bootstrap', 'build', 'manifest']
+
+    def __init__(self,source,dflts_file,skipDefaults,useCache=True,moduleYaml="",moduleFiles=None,lists=None):
+        self.source = source
+        self.moduleFiles = moduleFiles or admixProcessor.MODULE_FILES
+        self.dflts_file = dflts_file
+        self.skipDefaults = skipDefaults
+        self.useCache = useCache
+        self.moduleYaml = moduleYaml.split()
+        self.specs = {}        # yaml file -> mkParser, None if it could not be loaded
+        self.defaults = None   # parseDefaults result shared by all specs
+        self.sharedDefaults = not skipDefaults
+        self.setLists(lists or {})
+
+    def setLists(self,lists):
+        """ Use the space separated words of lists (name in LISTS -> string, None if not given)
+            as those lists, read the others from the source """
+        given = dict([(k, lists[k].split()) for k in admixProcessor.LISTS if lists.get(k) is not None])
+        if len(given) < len(admixProcessor.LISTS):
+            self.readLists()
+        for k in given:
+            setattr(self, k, given[k])
+
+    def readLists(self):
+        """ Set the bootstrap, system, build (yaml files) and manifest lists the same 
+            way yamlspecs/Makefile does """
+        if os.path.isdir(self.source):
+            bootstrap, system, build, manifest = self.moduleFiles
+            self.bootstrap = self.moduleWords(bootstrap)
+            self.system = self.moduleWords(system)
+            self.build = self.moduleWords(build, '.yaml')
+            if not os.path.exists(os.path.join(self.source, manifest)):
+                manifest = build
+            self.manifest = self.moduleWords(manifest)
+            return
+        pkgs = loadSpec(self.source, self.dflts_file, True, self.useCache)
+        self.bootstrap = [x for x in self.listQuery(pkgs,'bootstrap').split() if x != 'None']
+        self.system = self.listQuery(pkgs,'system').split()
+        build = self.listQuery(pkgs,'build')
+        if build:
+            self.build = (build.replace(' ', '.yaml ') + '.yaml').split()
+        else:
+            self.build = []
+        self.manifest = self.listQuery(pkgs,'manifest').split()
+
+    def moduleWords(self,fname,suffix=''):
+        """ words of the lines of fname that have no '#', suffix is added to each line.
+            A missing file has no words """
+        words = []
+        try:
+            with open(os.path.join(self.source,fname), 'r') as f:
+                lines = f.read().splitlines()
+        except (IOError, OSError):
+            return words
+        for line in lines:
+            if '#' not in line:
+                words.extend((line + suffix).split())
+        return words
+
+    def listQuery(self,mkp,query):
+        """ a query of packages.yaml with --quiet --listsep=' ' """
+        try:
+            rval = queryProcessor(mkp).query(query,' ')
+        except:
+            return ''
+        return str(rval)
+
+    def spec(self,yamlfile):
+        """ The loaded spec yamlfile, None if it does not exist or cannot be loaded """
+        global yaml
+        if yamlfile not in self.specs:
+            self.specs[yamlfile] = None
+            if not os.path.isfile(yamlfile):
+                return None
+            if self.sharedDefaults and self.defaults is None:
+                self.loadDefaults()
+            # a new loader for each spec, anchors of one spec are not seen by the next
+            yaml = None
+            try:
+                self.specs[yamlfile] = loadSpec(yamlfile, self.dflts_file, self.skipDefaults, 
+                                                self.useCache, self.defaults)
+            except Exception as ex:
+                sys.stderr.write("%s: %s\n" % (yamlfile, str(ex)))
+        return self.specs[yamlfile]
+
+    def loadDefaults(self):
+        """ Parse the defaults file once for all specs. A defaults file that refers to 
+            anchors it does not define depends on the spec and is parsed with each spec """
+        self.defaults = parseDefaults(self.dflts_file)
+        if self.defaults is None:
+            self.sharedDefaults = False
+
+    def query(self,yamlfile,query,listSep=None):
+        """ What gen-definitions.py --query prints for yamlfile, None if it fails """
+        mkp = self.spec(yamlfile)
+        if mkp is None:
+            return None
+        try:
+            return queryProcessor(mkp).queryOutput(query,listSep)
+        except Exception as ex:
+            sys.stderr.write("%s: %s\n" % (yamlfile, str(ex)))
+            return None
+
+    def manifestLines(self):
+        """ pkgname of each manifest entry that has a yaml file, the entry itself otherwise """
+        lines = []
+        for pkg in self.manifest:
+            if os.path.isfile(pkg + '.yaml'):
+                rval = self.query(pkg + '.yaml', 'pkgname')
+                if rval is not None:
+                    lines.append(rval)
+            else:
+                lines.append(pkg)
+        return lines
+
+    def providesLines(self):
+        """ module.logname of the manifest and MODULEYAML entries that are environment modules """
+        lines = []
+        for pkg in self.manifest + self.moduleYaml:
+            if self.query(pkg + '.yaml', 'envmodule') == 'True':
+                rval = self.query(pkg + '.yaml', 'module.logname')
+                if rval is not None:
+                    lines.append(rval)
+        return lines
+
+    def requiresLines(self):
+        """ build.modules of the build and bootstrap specs """
+        lines = []
+        for yamlfile in self.build + [x + '.yaml' for x in self.bootstrap]:
+            rval = self.query(yamlfile, 'build.modules', '\n')
+            if rval is not None and rval not in ('False', 'True', 'None'):
+                # as printed by echo -e of the unquoted shell variable
+                lines.extend([" ".join(l.split()) for l in rval.split('\n')])
+        return lines
+
+    def bootstrapLines(self,admixName):
+        """ the <admix>-bootstrap.yaml package that requires the modules needed by the admix
+            that it does not provide. A module counts as provided if it matches somewhere in 
+            the provided modules, as grep does, '.' matches any character """
+        needs = sorted(set(self.requiresLines()))
+        provides = " ".join(sorted(set(self.providesLines())))
+        lines = [ "!include rcic-admix-requires.yaml", "---",
+                  "- package: %s-bootstrap" % admixName,
+                  "  name: %s-bootstrap" % admixName,
+                  "  requires: " ]
+        for x in " ".join(needs).split():
+            pattern = ".".join([re.escape(p) for p in x.split('.')])
+            if not re.search(pattern, provides):
+                lines.append("    - %s" % x)
+        return lines
+
+    def words(self,yamlfile,query):
+        """ words of a list or string valued query of yamlfile, commas also separate words.
+            A missing keyword has no words """
+        mkp = self.spec(yamlfile)
+        if mkp is None:
+            return []
+        rval = queryProcessor(mkp).quietQuery(query,'\n')
+        return [w for w in re.split(r'[\s,]+', rval) if w]
+
+    def pkgGraph(self):
+        """ The build order constraints between the bootstrap and build specs of the admix.
+            Returns (nodes, deps): nodes are the yaml names (without .yaml) of the specs that
+            can be loaded, in list order; deps[X] the specs that must be built before X.
+            X depends on Y if a build.modules entry of X is the module.logname of Y (or the
+            start of it up to a '/', as module load finds the default version) or if a
+            requires entry of X is the pkgname or a provides entry of Y """
+        nodes = []
+        for yamlfile in [x + '.yaml' for x in self.bootstrap] + self.build:
+            name = yamlfile[:-len('.yaml')]
+            if name not in nodes and self.spec(yamlfile) is not None:
+                nodes.append(name)
+        lognames = []    # (module.logname, node)
+        rpms = {}        # pkgname or provides entry -> nodes
+        for name in nodes:
+            yamlfile = name + '.yaml'
+            if self.query(yamlfile, 'envmodule') == 'True':
+                logname = queryProcessor(self.spec(yamlfile)).quietQuery('module.logname')
+                if logname:
+                    lognames.append((logname, name))
+            for rpm in [self.query(yamlfile, 'pkgname')] + self.words(yamlfile, 'provides'):
+                if rpm is not None and name not in rpms.setdefault(rpm, []):
+                    rpms[rpm].append(name)
+        deps = {}
+        for name in nodes:
+            yamlfile = name + '.yaml'
+            found = []
+            for mod in self.words(yamlfile, 'build.modules'):
+                found.extend([n for l,n in lognames if l == mod or l.startswith(mod + '/')])
+            for rpm in self.words(yamlfile, 'requires'):
+                found.extend(rpms.get(rpm, []))
+            deps[name] = [n for n in nodes if n in found and n != name]
+        return nodes, deps
+
+    @staticmethod
+    def findCycle(nodes,deps):
+        """ A dependency cycle as a list of nodes, first and last the same. None if there is none """
+        state = {}     # node -> 1 while on the current path, 2 when done
+        for start in nodes:
+            if start in state:
+                continue
+            path = [start]
+            stack = [iter(deps[start])]
+            state[start] = 1
+            while stack:
+                try:
+                    dep = next(stack[-1])
+                except StopIteration:
+                    state[path.pop()] = 2
+                    stack.pop()
+                    continue
+                if state.get(dep) == 1:
+                    return path[path.index(dep):] + [dep]
+                if dep not in state:
+                    state[dep] = 1
+                    path.append(dep)
+                    stack.append(iter(deps[dep]))
+        return None
+
+    @staticmethod
+    def criticalPath(nodes,deps):
+        """ The longest chain of specs that have to be built one after the other,
+            deps must have no cycles """
+        chain = {}     # node -> longest chain ending with node
+        pending = list(reversed(nodes))
+        while pending:
+            name = pending[-1]
+            todo = [d for d in deps[name] if d not in chain]
+            if todo:
+                pending.extend(reversed(todo))
+                continue
+            pending.pop()
+            best = []
+            for d in deps[name]:
+                if len(chain[d]) > len(best):
+                    best = chain[d]
+            chain[name] = best + [name]
+        longest = []
+        for name in nodes:
+            if len(chain[name]) > len(longest):
+                longest = chain[name]
+        return longest
+
+    def bootstrapWaves(self,nodes,deps):
+        """ The bootstrap specs in waves, lists of yaml names: a spec is in the wave after the
+            last wave of the bootstrap specs it depends on, deps must have no cycles. Bootstrap
+            specs that can not be loaded are in the first wave, their build reports the error """
+        bootstrap = []
+        for name in self.bootstrap:
+            if name not in bootstrap:
+                bootstrap.append(name)
+        wave = dict([(name, 0) for name in bootstrap if name not in nodes])
+        while len(wave) < len(bootstrap):
+            for name in bootstrap:
+                if name in wave:
+                    continue
+                before = [d for d in deps[name] if d in bootstrap]
+                if all([d in wave for d in before]):
+                    wave[name] = max([wave[d] + 1 for d in before] or [0])
+        waves = [[] for i in range(max(list(wave.values()) or [-1]) + 1)]
+        for name in bootstrap:
+            waves[wave[name]].append(name)
+        return waves
+
+    def pkgdepsLines(self):
+        """ a makefile fragment with an X.pkg: Y.pkg rule for each spec Y that spec X depends on,
+            see pkgGraph. A dependency cycle is an error. The critical path is written as a comment.
+            BOOTSTRAP_WAVES numbers the bootstrapWaves, BOOTSTRAP_PKGS_<n> and BOOTSTRAP_RPMS_<n>
+            are the .pkg targets and the rpm names of wave n """
+        nodes, deps = self.pkgGraph()
+        cycle = admixProcessor.findCycle(nodes,deps)
+        if cycle is not None:
+            raise Exception("dependency cycle between packages: %s" % " -> ".join([x + '.pkg' for x in cycle]))
+        path = admixProcessor.criticalPath(nodes,deps)
+        lines = [ "## package build dependencies, generated by gen-definitions.py --admix=pkgdeps",
+                  "## critical path (%d packages): %s" % (len(path), " -> ".join([x + '.pkg' for x in path])) ]
+        for name in nodes:
+            if deps[name]:
+                lines.append("%s.pkg: %s" % (name, " ".join([d + '.pkg' for d in deps[name]])))
+        waves = self.bootstrapWaves(nodes,deps)
+        lines.append("## bootstrap packages, built and installed one wave after the other")
+        lines.append("BOOTSTRAP_WAVES = %s" % " ".join([str(n) for n in range(1, len(waves) + 1)]))
+        for n, wave in enumerate(waves):
+            rpms = [self.query(name + '.yaml', 'pkgname') for name in wave]
+            lines.append("BOOTSTRAP_PKGS_%d = %s" % (n + 1, " ".join([name + '.pkg' for name in wave])))
+            lines.append("BOOTSTRAP_RPMS_%d = %s" % (n + 1, " ".join([r for r in rpms if r is not None])))
+        return lines
+
+    def sourcesLines(self):
+        """ The source files of the bootstrap and build specs, for fetch-sources.py: one line per file
+            with the spec name, file name, vendor_source URL and checksum, '-' if the spec has none.
+            addsource files have no URL or checksum """
+        lines = []
+        seen = set()
+        for yamlfile in [x + '.yaml' for x in self.bootstrap] + self.build:
+            mkp = self.spec(yamlfile)
+            if mkp is None:
+                continue
+            qp = queryProcessor(mkp)
+            name = yamlfile[:-len('.yaml')]
+            files = [(qp.quietQuery('tarball'), qp.quietQuery('vendor_source'), qp.quietQuery('checksum'))]
+            files.extend([(x, '', '') for x in qp.quietQuery('addsource',' ').split()])
+            for fname, url, checksum in files:
+                # src_tarball: none, as in rcic-module.yaml, is a spec without a tarball
+                if fname and fname != 'none' and fname not in seen:
+                    seen.add(fname)
+                    lines.append(" ".join([name, fname, url.strip() or '-', checksum.strip() or '-']))
+        return lines
+
+    def output(self,what,admixName=None):
+        """ lines of output what, one of OUTPUTS """
+        if what == 'manifest':
+            return self.manifestLines()
+        elif what == 'module-provides':
+            return self.providesLines()
+        elif what == 'module-requires':
+            return self.requiresLines()
+        elif what == 'bootstrap-yaml':
+            if admixName is None:
+                admixName = admixProcessor.defaultName(self.source)
+            return self.bootstrapLines(admixName)
+        elif what == 'pkgdeps':
+            return self.pkgdepsLines()
+        elif what == 'sources':
+            return self.sourcesLines()
+        raise Exception("unknown admix output '%s', use one of: %s" % (what, ", ".join(admixProcessor.OUTPUTS)))
+
+    @staticmethod
+    def defaultName(source):
+        """ The admix name yamlspecs/Makefile uses: the name of the parent of the yamlspecs directory """
+        if not os.path.isdir(source):
+            source = os.path.dirname(source) or '.'
+        return os.path.basename(os.path.realpath(os.path.join(source, '..')))
+
+def diffData(a,b,path,diffs):
+    """ Append to diffs a description of every difference between the parsed YAML data a and b """
+    if type(a) is not type(b):
+        diffs.append("%s: %s %r != %s %r" % (path, type(a).__name__, a, type(b).__name__, b))
+    elif type(a) is dict:
+        for k in a:
+            if k not in b:
+                diffs.append("%s.%s: missing in the second" % (path, k))
+            else:
+                diffData(a[k],b[k],"%s.%s" % (path, k),diffs)
+        for k in b:
+            if k not in a:
+                diffs.append("%s.%s: missing in the first" % (path, k))
+    elif type(a) is list:
+        if len(a) != len(b):
+            diffs.append("%s: %d != %d items" % (path, len(a), len(b)))
+        for i in range(min(len(a),len(b))):
+            diffData(a[i],b[i],"%s[%d]" % (path, i),diffs)
+    elif a != b:
+        diffs.append("%s: %r != %r" % (path, a, b))
+    return diffs
+
+def checkLoader(yamlfile,dflts_file,skipDefaults):
+    """ Parse yamlfile, its includes and the defaults file with each YAML loader backend 
+        and print the differences. Returns the number of differences """
+    global yaml, incIndex
+    missing = [b for b in yamlLoader.BACKENDS if not yamlLoader.available(b)]
+    if missing:
+        sys.stderr.write("%s: ruamel.yaml.clib is not installed, --check-loader can only use the pure "
+                         "loader and has nothing to compare it with\n" % yamlfile)
+        return 0
+    parsed = []
+    for backend in yamlLoader.BACKENDS:
+        # fresh loader and include index, nothing parsed by the other backend is reused
+        yaml = yamlLoader(backend)
+        incIndex = None
+        mkp = mkParser()
+        mkp.readPkgYaml(yamlfile)
+        if not skipDefaults:
+            mkp.readDefaultsYaml(dflts_file)
+        parsed.append((backend,mkp))
+    (first,a), (second,b) = parsed
+    diffs = diffData(a.kvdict,b.kvdict,yamlfile,[])
+    if not skipDefaults:
+        diffData(a.defaults,b.defaults,dflts_file,diffs)
+    for d in diffs:
+        print(d)
+    print("%s: %d differences between the %s and %s loaders" % (yamlfile, len(diffs), first, second))
+    return len(diffs)
+
+def checkMap(mapping,option):
+    """ mapping as a dictionary of include file names, for the error messages option is the 
+        command line option it came from. None is no mapping """
+    if mapping is None:
+        return {}
+    if type(mapping) is not dict or [x for x in list(mapping.keys()) + list(mapping.values())
+                                     if type(x) in (dict, list, type(None))]:
+        raise Exception("%s: a mapping must be a dictionary of file names, not: %s" % (option, str(mapping)))
+    return dict([(str(k), str(mapping[k])) for k in mapping])
+
+def parseMap(text):
+    """ The mapping of --map, a python dictionary literal """
+    import ast
+    try:
+        mapping = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        raise Exception("--map: not a python dictionary: %s" % text)
+    return checkMap(mapping, "--map")
+
+def variantName(mapping):
+    """ Name of the variant of a mapping: the names of the substitute files without their
+        extension, gcc-versions-8 for {'gcc-versions.yaml':'gcc-versions-8.yaml'} """
+    names = [os.path.splitext(os.path.basename(mapping[k]))[0] for k in sorted(mapping)]
+    return "+".join(names) or "default"
+
+def readVariants(source):
+    """ The variants of --variants as a list of (name, mapping). source is a YAML file or a
+        python literal, either a list of --map mappings (named by variantName) or a dictionary
+        of variant name -> mapping """
+    if os.path.isfile(source):
+        with open(source, 'r') as f:
+            variants = getYaml().load(f)
+    else:
+        import ast
+        try:
+            variants = ast.literal_eval(source)
+        except (ValueError, SyntaxError):
+            raise Exception("--variants: not a file or a python literal: %s" % source)
+    if type(variants) is dict:
+        items = [(str(k), variants[k]) for k in variants]
+    elif type(variants) is list:
+        items = [(None, m) for m in variants]
+    else:
+        raise Exception("--variants: a list of mappings or a dictionary of name: mapping, not: %s" % str(variants))
+    result = []
+    for name, mapping in items:
+        mapping = checkMap(mapping, "--variants")
+        if name is None:
+            name = variantName(mapping)
+        if not name or name in [n for n, m in result] or os.sep in name:
+            raise Exception("--variants: variant names must be unique file names: '%s'" % name)
+        result.append((name, mapping))
+    return result
+
+def runVariants(args,variants):
+    """ Definitions.mk, the module file or the query answer of args.yamlfile for each of 
+        variants (see readVariants), the --map mapping of each added to that of args. The output
+        of each follows a '## variant <name>' line, with args.outdir emitAll writes into 
+        outdir/<name>. The include index and the defaults are shared: an included file or the
+        defaults file is only parsed again for a variant that maps a file it includes.
+        Returns the number of variants that failed """
+    global readFiles, mapUses, yaml
+    base = dict(incMap)
+    defaults = warmDefaults
+    if defaults is None:
+        defaults = defaultsCache()
+    failed = 0
+    try:
+        for name, mapping in variants:
+            incMap.clear()
+            incMap.update(base)
+            incMap.update(mapping)
+            readFiles, mapUses = {}, {}
+            # a new loader for each variant, anchors of one variant are not seen by the next
+            yaml = None
+            try:
+                shared = None
+                if not args.skipDefaults:
+                    shared = defaults.get(args.dflts_file)
+                mkP = loadSpec(args.yamlfile, args.dflts_file, args.skipDefaults, not args.noCache, shared)
+                if args.outdir:
+                    timer.timed("generate", emitAll, mkP, os.path.join(args.outdir, name))
+                    continue
+                timer.begin("generate")
+                try:
+                    if args.doModule:
+                        out = moduleGenerator(mkP).generate()
+                    elif args.doQuery and args.quiet:
+                        out = queryProcessor(mkP).quietQuery(args.doQuery, args.listSep)
+                    elif args.doQuery:
+                        out = queryProcessor(mkP).queryOutput(args.doQuery, args.listSep)
+                    else:
+                        out = makeIncludeGenerator(mkP).generate()
+                finally:
+                    timer.end()
+            except Exception as ex:
+                sys.stderr.write("%s: variant %s: %s\n" % (args.yamlfile, name, str(ex)))
+                failed += 1
+                continue
+            print("## variant %s" % name)
+            print(out)
+    finally:
+        incMap.clear()
+        incMap.update(base)
+    return failed
+
+def serverSocket():
+    """ The socket of the gen-definitions.py server: YAML2RPM_SERVER if set, otherwise a per 
+        user socket in XDG_RUNTIME_DIR or the temporary directory """
+    path = os.environ.get('YAML2RPM_SERVER')
+    if path:
+        return path
+    import tempfile
+    rundir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(rundir, "yaml2rpm-gen-%d.sock" % os.getuid())
+
+class definitionsServer(object):
+    """ Runs the gen-definitions.py calls sent by gen-definitions-client.py, one at a time in 
+        this process, so that they do not pay for starting python and importing ruamel. The 
+        include index (directory listings, file contents and parsed !include files) of each 
+        directory and include path and the parsed defaults files are kept between calls; 
+        before each call they are checked against the files on disk.
+        A request is a JSON object with the argv, cwd and environment of the call, the reply 
+        has its exit status, stdout and stderr. A status of null tells the client to run the
+        call itself: the server exits when gen-definitions.py has changed or on {"stop": true} """
+    IDLE = 3600   # seconds without a call after which the server exits
+
+    def __init__(self,path,idle=IDLE):
+        self.path = path
+        self.idle = idle
+        self.indexes = {}    # (cwd, YAML2RPM_INC) -> IncIndex
+        self.defaults = defaultsCache()
+        self.program = os.path.abspath(__file__)
+        self.signature = statSignature(self.program)
+
+    def listen(self):
+        """ The listening socket. Only the owner can connect: a call can run any code (--map) """
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(self.path):
+            try:
+                s.connect(self.path)
+            except socket.error:
+                os.remove(self.path)   # left by a server that is gone
+            else:
+                s.close()
+                raise Exception("a server is already listening on %s" % self.path)
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            s.bind(self.path)
+        finally:
+            os.umask(umask)
+        s.listen(16)
+        s.settimeout(self.idle)
+        return s
+
+    def serve(self):
+        """ Answer calls until stopped, idle for IDLE seconds or gen-definitions.py changes """
+        import json
+        listener = self.listen()
+        try:
+            running = True
+            while running:
+                try:
+                    conn, addr = listener.accept()
+                except socket.timeout:
+                    break
+                conn.settimeout(None)
+                try:
+                    data = []
+                    chunk = conn.recv(65536)
+                    while chunk:
+                        data.append(chunk)
+                        chunk = conn.recv(65536)
+                    request = json.loads(b"".join(data).decode('utf-8'))
+                    if request.get('stop'):
+                        reply, running = {'status': None, 'reason': 'stopped'}, False
+                    elif [a for a in request['argv'] if a.startswith('--server')]:
+                        reply = {'status': None, 'reason': 'server options are not run by the server'}
+                    elif statSignature(self.program) != self.signature:
+                        reply, running = {'status': None, 'reason': '%s changed' % self.program}, False
+                    else:
+                        reply = self.call(request)
+                    conn.sendall(json.dumps(reply).encode('utf-8'))
+                except Exception as ex:
+                    sys.stderr.write("gen-definitions.py server: %s\n" % str(ex))
+                finally:
+                    conn.close()
+        finally:
+            listener.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def call(self,request):
+        """ Run main with the argv, cwd and environment of request in this process """
+        global incIndex, yaml, readFiles, mapUses, timer, warmDefaults
+        import traceback
+        try:
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+        out, err = StringIO(), StringIO()
+        saved = (os.getcwd(), dict(os.environ), sys.stdout, sys.stderr)
+        status = 0
+        try:
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            # what a call leaves behind is reset, what is kept between calls is revalidated
+            incMap.clear()
+            readFiles = {}
+            mapUses = {}
+            yaml = None
+            timer = runTimer()
+            key = (os.getcwd(), os.environ.get('YAML2RPM_INC'))
+            if key not in self.indexes:
+                self.indexes[key] = IncIndex(IncPath().getPath())
+            incIndex = self.indexes[key]
+            incIndex.revalidate()
+            warmDefaults = self.defaults
+            sys.stdout, sys.stderr = out, err
+            main(request['argv'])
+        except SystemExit as ex:
+            if ex.code is None or type(ex.code) is int:
+                status = ex.code or 0
+            else:
+                err.write("%s\n" % ex.code)
+                status = 1
+        except Exception:
+            # as python prints it, without the frame of this method
+            etype, value, tb = sys.exc_info()
+            traceback.print_exception(etype, value, tb.tb_next, file=err)
+            status = 1
+        finally:
+            cwd, environ, sys.stdout, sys.stderr = saved
+            warmDefaults = None
+            os.environ.clear()
+            os.environ.update(environ)
+            os.chdir(cwd)
+        return {'status': status, 'stdout': out.getvalue(), 'stderr': err.getvalue()}
+
+    @staticmethod
+    def stop(path):
+        """ Ask the server listening on path to exit. Returns False if none is listening """
+        import json
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(path)
+            s.sendall(json.dumps({'stop': True}).encode('utf-8'))
+            s.shutdown(socket.SHUT_WR)
+            s.recv(65536)
+        except socket.error:
+            return False
+        finally:
+            s.close()
+        return True
+
 ## *****************************
 ## main routine
 ## *****************************
 
 def main(argv):
-    global incMap
 
     dflts_file = 'pkg-defaults.yaml'  # defaults package file, assume in the current yamlspecs/ directory 
 
@@ -761,6 +2313,44 @@ def main(argv):
     helpmap += "package. Mapping is  python dictionary, ke is the original file, and the value is the substitute file. For \n"
     helpmap += "example, -map=\"{'gcc-versions.yaml':'gcc-versions-8.yaml'}\" replaces default yaml file with a specific version"
 
+    helpvariants = "generate the output for several --map mappings of the yaml file in one run. VARIANTS is a YAML file\n"
+    helpvariants += "or a python literal: a list of mappings or a dictionary of variant name: mapping. For example,\n"
+    helpvariants += "--variants=\"[{'gcc-versions.yaml':'gcc-versions-8.yaml'},{'gcc-versions.yaml':'gcc-versions-9.yaml'}]\"\n"
+    helpvariants += "The output of each variant follows a '## variant NAME' line, with --outdir it is written into OUTDIR/NAME.\n"
+    helpvariants += "A list entry is named by its substitute files (gcc-versions-8). --map applies to every variant"
+
+    helpoutdir = "parse once and write %s, %s and %s (answers to the queries\n" % (DEFINITIONS,MODULEFILE,QUERIES)
+    helpoutdir += "%s as shell variables) into the given directory\n" % ", ".join([q for q,l in EMIT_QUERIES])
+
+    helpdepfile = "write a make depfile: the .pkg target of the yaml file depends on every file read while parsing it\n"
+    helpdepfile += "and the patch, tarball, addfile and addsource files. Alone, or with --outdir, nothing is printed"
+
+    helpnocache = "do not use the spec cache. Parsed and resolved specs are cached in $YAML2RPM_CACHE or\n"
+    helpnocache += "~/.cache/yaml2rpm and reused while the spec and every included file are unchanged.\n"
+    helpnocache += "YAML2RPM_CACHE=off also disables the cache"
+
+    helpadmix = "batch mode for a whole admix: yamlfile is packages.yaml or a directory with modules.* files.\n"
+    helpadmix += "Prints the output of the yamlspecs/Makefile target of the same name, all specs are parsed\n"
+    helpadmix += "in one process. One of: %s" % ", ".join(admixProcessor.OUTPUTS)
+
+    helpmodulefiles = "for --admix with a directory: the bootstrap, system, build and manifest files, comma separated.\n"
+    helpmodulefiles += "Default is %s" % ",".join(admixProcessor.MODULE_FILES)
+
+    helpcheckloader = "parse the yaml file, its includes and the defaults file with both the C (ruamel.yaml.clib)\n"
+    helpcheckloader += "and the pure python YAML loaders and print the differences. Exit status is 1 if they differ.\n"
+    helpcheckloader += "YAML2RPM_LOADER=c|pure selects the loader for normal runs, default is C when installed"
+
+    helptimings = "print the time spent in each phase (loader, include, parse, merge, resolve, cache, generate)\n"
+    helptimings += "to stderr. YAML2RPM_GENTIMINGS=yes does the same for every call, YAML2RPM_GENTIMINGS=<file>\n"
+    helptimings += "appends the timings of every call to the file, e.g. of all calls of make buildall"
+
+    helpprofile = "write cProfile statistics of the run to PROFILE, read them with python -m pstats PROFILE.\n"
+    helpprofile += "YAML2RPM_GENPROFILE=<directory> profiles every call, each into <directory>/<yaml name>.<pid>.prof"
+
+    helpserver = "run as a server for gen-definitions-client.py on the unix socket SERVER, default is $YAML2RPM_SERVER\n"
+    helpserver += "or %s. Calls sent by the client are run in this process, with ruamel,\n" % serverSocket()
+    helpserver += "the include files and the defaults files kept loaded while they do not change on disk"
+
     parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawTextHelpFormatter)
     # optional arguments
     parser.add_argument("-d", "--defaults", dest="dflts_file", default=dflts_file, help=helpdefaults)
@@ -770,36 +2360,126 @@ def main(argv):
     parser.add_argument("-l", "--listsep",  dest="listSep",    default=None,  help=helplsep)
     parser.add_argument("-Q", "--quiet",    dest="quiet",      default=False, action='store_true', help="supress output of query processing")
     parser.add_argument("-M", "--map",      dest="mapf",       default=False, help=helpmap)
+    parser.add_argument("--variants",       dest="variants",   default=None,  help=helpvariants)
+    parser.add_argument("-o", "--outdir",   dest="outdir",     default=None,  help=helpoutdir)
+    parser.add_argument("--depfile",        dest="depfile",    default=None,  help=helpdepfile)
+    parser.add_argument("--sources",        dest="sources",    default="../sources", help="directory of the tarball and addsource files for --depfile, default is ../sources")
+    parser.add_argument("-C", "--no-cache", dest="noCache",    default=False, action='store_true', help=helpnocache)
+    parser.add_argument("-A", "--admix",    dest="admix",      default=None,  help=helpadmix)
+    parser.add_argument("--admix-name",     dest="admixName",  default=None,  help="admix name for --admix=bootstrap-yaml, default is the name of the parent of the yamlspecs directory")
+    parser.add_argument("--moduleyaml",     dest="moduleYaml", default="",    help="additional specs (names without .yaml) for --admix=module-provides")
+    parser.add_argument("--modules-files",  dest="moduleFiles", default=None, help=helpmodulefiles)
+    parser.add_argument("--bootstrap-modules", dest="bootstrapList", default=None, help="for --admix: the bootstrap packages (names without .yaml), instead of those of yamlfile")
+    parser.add_argument("--build-modules",  dest="buildList",  default=None,  help="for --admix: the yaml files of the packages to build, instead of those of yamlfile")
+    parser.add_argument("--manifest",       dest="manifestList", default=None, help="for --admix: the manifest entries, instead of those of yamlfile")
+    parser.add_argument("--check-loader",   dest="checkLoader", default=False, action='store_true', help=helpcheckloader)
+    parser.add_argument("--timings",        dest="timings",    default=None,  action='store_const', const='-', help=helptimings)
+    parser.add_argument("--profile",        dest="profile",    default=None,  help=helpprofile)
+    parser.add_argument("--server",         dest="server",     default=None,  nargs='?', const=serverSocket(), help=helpserver)
+    parser.add_argument("--server-idle",    dest="serverIdle", default=definitionsServer.IDLE, type=int, help="seconds without calls after which the server exits, default is %d" % definitionsServer.IDLE)
+    parser.add_argument("--server-stop",    dest="serverStop", default=None,  nargs='?', const=serverSocket(), help="stop the server listening on the socket SERVER-STOP")
     # required positional argument
-    parser.add_argument("yamlfile",  action="store", help="main YAML file with packaging definitions") 
-    args = parser.parse_args()
-    
-    if args.mapf: 
-        incMap.update(eval(args.mapf))
-
-    # Open input yaml files, parse, generate
-    mkP = mkParser()
-    mkP.readPkgYaml(args.yamlfile)
-    if not args.skipDefaults:
-        mkP.readDefaultsYaml(args.dflts_file)
-    mkP.resolveVars()
-
-    ### DEBUG
-    #a = mkP.__dict__['varsdict']
-    #print ("DEBUG", type(a), a.keys())
-
-    mg = moduleGenerator(mkP)
-    #print ("DEBUG2", mg.__dict__['reqs'])
+    parser.add_argument("yamlfile",  action="store", help="main YAML file with packaging definitions", nargs='?') 
+    args = parser.parse_args(argv)
+
+    if args.serverStop:
+        if not definitionsServer.stop(args.serverStop):
+            sys.stderr.write("no server is listening on %s\n" % args.serverStop)
+            sys.exit(1)
+        return
+    if args.server:
+        definitionsServer(args.server, args.serverIdle).serve()
+        return
+    if args.yamlfile is None:
+        parser.error("the following arguments are required: yamlfile")
+
+    profile = args.profile
+    if profile is None and os.environ.get('YAML2RPM_GENPROFILE'):
+        profdir = os.environ['YAML2RPM_GENPROFILE']
+        if not os.path.isdir(profdir):
+            os.makedirs(profdir)
+        profile = os.path.join(profdir, "%s.%d.prof" % (os.path.basename(args.yamlfile), os.getpid()))
+    timings = args.timings or os.environ.get('YAML2RPM_GENTIMINGS') or None
+    if timings is not None and timings.lower() in ("1", "yes", "on", "stderr"):
+        timings = '-'
+    timer.enabled = timings is not None
+    title = " ".join(["gen-definitions.py"] + argv)
+
+    # the timings and the profile are written also when the run fails or exits early
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run(parser, args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+        if timer.enabled:
+            timer.write(timings, title)
+
+def run(parser,args):
+    """ Do what the command line args ask for """
+    global incMap
 
-    mig = makeIncludeGenerator(mkP)
-    qp = queryProcessor(mkP)
+    backend = yamlLoader.defaultBackend()
+    if backend == 'c' and not yamlLoader.available(backend) and not args.checkLoader:
+        sys.stderr.write("YAML2RPM_LOADER=c: C loader requested but ruamel.yaml.clib is not installed\n")
+        sys.exit(1)
 
-    if args.doModule: 
-        print(mg.generate() )
-    elif args.doQuery:
-        qp.processQuery(args.doQuery,args.quiet,args.listSep)
-    else:
-        print(mig.generate())
+    if args.mapf: 
+        incMap.update(parseMap(args.mapf))
+
+    if args.variants:
+        if args.admix or args.checkLoader or args.depfile:
+            parser.error("--variants can not be used with --admix, --check-loader or --depfile")
+        if runVariants(args, readVariants(args.variants)):
+            sys.exit(1)
+        return
+
+    if args.checkLoader:
+        if checkLoader(args.yamlfile, args.dflts_file, args.skipDefaults):
+            sys.exit(1)
+        return
+
+    if args.admix:
+        moduleFiles = None
+        if args.moduleFiles:
+            moduleFiles = args.moduleFiles.split(',')
+            if len(moduleFiles) != 4:
+                parser.error("--modules-files needs 4 comma separated names")
+        lists = {'bootstrap': args.bootstrapList, 'build': args.buildList, 'manifest': args.manifestList}
+        admix = admixProcessor(args.yamlfile, args.dflts_file, args.skipDefaults, not args.noCache, 
+                               args.moduleYaml, moduleFiles, lists)
+        lines = timer.timed("generate", admix.output, args.admix, args.admixName)
+        if lines:
+            print("\n".join(lines))
+        return
+
+    # Open input yaml files, parse, generate. A query resolves only what it looks up
+    lazy = bool(args.doQuery) and not (args.doModule or args.outdir)
+    mkP = loadSpec(args.yamlfile, args.dflts_file, args.skipDefaults, not args.noCache, lazy=lazy)
+
+    if args.depfile:
+        timer.timed("generate", writeDepfile, mkP, args.depfile, os.path.splitext(args.yamlfile)[0] + ".pkg", args.sources)
+    if args.outdir:
+        timer.timed("generate", emitAll, mkP, args.outdir)
+        return
+    if args.depfile and not (args.doModule or args.doQuery):
+        return
+
+    timer.begin("generate")
+    try:
+        if args.doModule: 
+            print(moduleGenerator(mkP).generate())
+        elif args.doQuery:
+            queryProcessor(mkP).processQuery(args.doQuery,args.quiet,args.listSep)
+        else:
+            print(makeIncludeGenerator(mkP).generate())
+    finally:
+        timer.end()
 
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -1,7 +1,14 @@
 #!/bin/env python
-# Generate an ansible file from a manifest 
+# Generate an ansible file from a manifest
+#
+# Package names come from the command line (- is stdin), from files (--file, - is stdin) or from
+# stdin when neither is given, one or more per line, '#' starts a comment. Files are read line by line and
+# each name is kept once. --admix NAME=FILE adds the packages of several admixes: they are merged
+# into one playbook, or written to one task file per admix with --outdir. Each playbook is written
+# with a single write.
 
 import argparse
+import os
 import sys
 #    from __future__ import print_function
 
@@ -17,6 +24,55 @@ TEMPLATE = """---
     pkglist:"""
 PKGSTR = "      - %s"
 
+def readNames(fname):
+    """ package names of the file fname, - is stdin, in file order """
+    f = sys.stdin if fname == '-' else open(fname, 'r')
+    try:
+        for line in f:
+            for name in line.split('#', 1)[0].split():
+                yield name
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+class playbookWriter(object):
+    """ The package lists of admixes. With merge, all admixes share one list and one playbook,
+        otherwise each admix has its own. A name is listed once per list """
+
+    def __init__(self, merge=True):
+        self.merge = merge
+        self.admixes = []      # admix names, in the order they were added
+        self.pkgs = {}         # list key -> package names
+        self.seen = {}         # list key -> set of package names
+
+    def add(self, admixName, names):
+        """ Add the package names (any iterable) of admixName """
+        if admixName not in self.admixes:
+            self.admixes.append(admixName)
+        key = None if self.merge else admixName
+        pkgs = self.pkgs.setdefault(key, [])
+        seen = self.seen.setdefault(key, set())
+        for name in names:
+            if name not in seen:
+                seen.add(name)
+                pkgs.append(name)
+
+    def playbook(self, admixName, pkgs):
+        lines = [TEMPLATE % admixName]
+        lines.extend([PKGSTR % pkg for pkg in pkgs])
+        return "\n".join(lines) + "\n"
+
+    def merged(self):
+        """ the playbook of all admixes """
+        return self.playbook(", ".join(self.admixes), self.pkgs.get(None, []))
+
+    def perAdmix(self):
+        """ (admix name, playbook) of each admix """
+        return [(a, self.playbook(a, self.pkgs.get(a, []))) for a in self.admixes]
+
+    def empty(self):
+        return not any(self.pkgs.values())
+
 ## *****************************
 ## main routine
 ## *****************************
@@ -25,21 +81,65 @@ def main(argv):
 
     admixName = "UNKNOWN"
     # description and help lines for the usage  help
-    description = "reads a list of package names from the command line and \n" 
+    description = "reads a list of package names from the command line, files or stdin and \n"
     description += "creates an ansible playbook with these listed\n"
 
     helpname = "Name of the admix that created this list. Defaults to UNKNOWN\n"
+    helpfile = "file with package names of the admix of --name, - is stdin. Can be repeated.\n"
+    helpfile += "Without packages or --file, the names are read from stdin"
+    helpadmix = "package names of the admix NAME in FILE, - is stdin. Can be repeated, the packages\n"
+    helpadmix += "of all admixes are merged into one playbook"
+    helpoutdir = "write one task file <admix>.yml per admix into this directory instead of one playbook"
 
     parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument("-n", "--name", dest="admixName", default=admixName, help=helpname)
-    # required positional argument
-    parser.add_argument("pkgs",  action="store", help="packages to be installed", nargs='+') 
-    args = parser.parse_args()
-    
-    print(TEMPLATE % args.admixName)
-    for pkg in args.pkgs:
-        print(PKGSTR % pkg)
+    parser.add_argument("-f", "--file", dest="files", default=[], action='append', help=helpfile)
+    parser.add_argument("-a", "--admix", dest="admixes", default=[], action='append', metavar="NAME=FILE", help=helpadmix)
+    parser.add_argument("-d", "--outdir", dest="outdir", default=None, help=helpoutdir)
+    parser.add_argument("-o", "--output", dest="output", default=None, help="write the playbook to this file instead of stdout")
+    # optional positional argument
+    parser.add_argument("pkgs",  action="store", help="packages to be installed, - reads them from stdin", nargs='*')
+    args = parser.parse_args(argv)
+
+    sources = []
+    for spec in args.admixes:
+        if '=' not in spec:
+            parser.error("--admix needs NAME=FILE, got '%s'" % spec)
+        sources.append(tuple(spec.split('=', 1)))
+    pkgs = [p for p in args.pkgs if p != '-']
+    files = args.files
+    if '-' in args.pkgs and '-' not in files:
+        files = files + ['-']
+    if not pkgs and not files and not sources:
+        files = ['-']
+
+    writer = playbookWriter(merge=args.outdir is None)
+    try:
+        if pkgs:
+            writer.add(args.admixName, pkgs)
+        for fname in files:
+            writer.add(args.admixName, readNames(fname))
+        for name, fname in sources:
+            writer.add(name, readNames(fname))
+    except (IOError, OSError) as ex:
+        sys.stderr.write("manifest2ansible.py: %s\n" % str(ex))
+        sys.exit(1)
+    if writer.empty():
+        sys.stderr.write("manifest2ansible.py: no package names\n")
+        sys.exit(1)
+
+    if args.outdir is not None:
+        if not os.path.isdir(args.outdir):
+            os.makedirs(args.outdir)
+        for name, text in writer.perAdmix():
+            with open(os.path.join(args.outdir, "%s.yml" % name), 'w') as f:
+                f.write(text)
+        return
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(writer.merged())
+        return
+    sys.stdout.write(writer.merged())
 
 if __name__ == "__main__":
     main(sys.argv[1:])
-        
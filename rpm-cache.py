@@ -0,0 +1,380 @@
+#!/bin/env python
+# Keep the RPMs built by admixes in a cache shared by admixes and build hosts
+#
+# The key of a package build is the sha256 of the files in its build directory before make pkg:
+# the Definitions.mk, modulefile (without the date and host of its header), Queries.sh and
+# builder templates written by the %.build target, and the tarball, patch, addfile, addsource
+# and pretar files copied there, together with the operating system and machine of the host and
+# the keys of the builds of the packages it is built against (--deps), so that a package is built
+# again when one of them changes.
+#
+#    rpm-cache.py restore BUILDDIR --rpms=PATTERNS   copy the RPMs stored for the key of BUILDDIR
+#                                                     into the RPMS directory, exit status 1 if
+#                                                     there are none
+#    rpm-cache.py store BUILDDIR --rpms=PATTERNS     store the RPMs of the finished build under
+#                                                     the key computed by restore
+#    rpm-cache.py evict                              remove entries by --max-age and --max-size
+#
+# PATTERNS are the file patterns of the RPMs of the package, printed by make rpmglob in BUILDDIR.
+# Each entry of the cache is entries/<key>/<arch>/<rpm file> and inputs.json, the files the key
+# was computed from. Entries are written to a temporary directory and renamed into place, so a
+# cache on a shared file system is never seen half written. The modification time of an entry
+# is the last time it was stored or restored, entries used least recently are evicted first.
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+KEYFILE = '.rpm-cache-key'
+KEY_VERSION = 'rpm-cache 2'
+BLOCKSIZE = 1024 * 1024
+# header lines of the modulefile that change with each generation
+MODULEFILE_VOLATILE = ('## Date:', '## Built on:')
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+def parseSize(text):
+    """ bytes of a size written as a number with an optional K, M, G or T suffix """
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+def fileDigest(path):
+    """ sha256 of the contents of path, without the volatile header lines of a modulefile """
+    h = hashlib.sha256()
+    if os.path.basename(path) == 'modulefile':
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.decode('utf-8', 'replace').startswith(MODULEFILE_VOLATILE):
+                    h.update(line)
+        return h.hexdigest()
+    with open(path, 'rb') as f:
+        block = f.read(BLOCKSIZE)
+        while block:
+            h.update(block)
+            block = f.read(BLOCKSIZE)
+    return h.hexdigest()
+
+def hostPlatform():
+    """ operating system and machine of the host, e.g. 'rocky 8.9 x86_64' """
+    release = {}
+    try:
+        with open('/etc/os-release', 'r') as f:
+            for line in f:
+                if '=' in line:
+                    name, value = line.strip().split('=', 1)
+                    release[name] = value.strip('"\'')
+    except (IOError, OSError):
+        pass
+    return " ".join([release.get('ID', platform.system()), release.get('VERSION_ID', platform.release()),
+                     platform.machine()])
+
+def buildInputs(builddir):
+    """ digest of each file in builddir, by its path relative to builddir """
+    inputs = {}
+    for dirpath, dirnames, filenames in os.walk(builddir):
+        for fname in filenames:
+            path = os.path.join(dirpath, fname)
+            relpath = os.path.relpath(path, builddir)
+            if relpath == KEYFILE or not os.path.isfile(path):
+                continue
+            inputs[relpath] = fileDigest(path)
+    return inputs
+
+def depKeys(keyfiles):
+    """ key of each build directory whose KEYFILE is in keyfiles, by the name of the directory.
+        The key is None if there is none: the package was built without the cache, or its build
+        directory was removed """
+    keys = {}
+    for keyfile in keyfiles:
+        try:
+            with open(keyfile, 'r') as f:
+                key = json.load(f).get('key')
+        except (IOError, OSError, ValueError):
+            key = None
+        keys[os.path.basename(os.path.dirname(os.path.abspath(keyfile)))] = key
+    return keys
+
+def buildKey(inputs, host, deps):
+    """ the key of a build from its inputs, host platform and the keys of its dependencies """
+    h = hashlib.sha256()
+    h.update(("%s\n%s\n" % (KEY_VERSION, host)).encode('utf-8'))
+    for relpath in sorted(inputs):
+        h.update(("%s %s\n" % (inputs[relpath], relpath)).encode('utf-8'))
+    for name in sorted(deps):
+        h.update(("dep %s %s\n" % (deps[name], name)).encode('utf-8'))
+    return h.hexdigest()
+
+def copyFile(src, dest):
+    """ Copy src to dest. dest is replaced at once, never seen half written """
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(dest) or '.', prefix='.rpm-cache-')
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmpname)
+        os.chmod(tmpname, 0o644)
+        os.rename(tmpname, dest)
+    except Exception:
+        os.remove(tmpname)
+        raise
+
+def rpmFiles(patterns):
+    """ the existing files that match any of patterns, a space separated string """
+    files = []
+    for pattern in patterns.split():
+        for path in sorted(glob.glob(pattern)):
+            if os.path.isfile(path) and path not in files:
+                files.append(path)
+    return files
+
+def rpmsDir(patterns):
+    """ the RPMS directory of patterns, which are RPMS/<arch>/<rpm file> patterns """
+    return os.path.dirname(os.path.dirname(os.path.normpath(patterns.split()[0])))
+
+class rpmCache(object):
+    """ The cache in cachedir. entries/ has an entry for each key, tmp/ the entries being
+        stored or removed """
+
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+        for d in ('entries', 'tmp'):
+            path = os.path.join(cachedir, d)
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # made by another build at the same time
+                    if not os.path.isdir(path):
+                        raise
+
+    @staticmethod
+    def defaultDir():
+        """ YAML2RPM_RPM_CACHE if set, otherwise yaml2rpm-rpms/ in the user cache directory.
+            Returns None if the cache is turned off with YAML2RPM_RPM_CACHE=off """
+        cachedir = os.environ.get('YAML2RPM_RPM_CACHE')
+        if cachedir is not None:
+            if cachedir.lower() in ("", "off", "no", "none"):
+                return None
+            return cachedir
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        return os.path.join(base, 'yaml2rpm-rpms')
+
+    def entry(self, key):
+        return os.path.join(self.cachedir, 'entries', key)
+
+    def entryFiles(self, key):
+        """ <arch>/<rpm file> of each RPM stored for key """
+        files = []
+        entry = self.entry(key)
+        for arch in sorted(os.listdir(entry)):
+            if os.path.isdir(os.path.join(entry, arch)):
+                files.extend([os.path.join(arch, f) for f in sorted(os.listdir(os.path.join(entry, arch)))])
+        return files
+
+    def restore(self, key, rpmsdir):
+        """ Copy the RPMs stored for key into rpmsdir/<arch>. Returns their names, an empty
+            list if key is not in the cache """
+        if not os.path.isdir(self.entry(key)):
+            return []
+        files = self.entryFiles(key)
+        for relpath in files:
+            dest = os.path.join(rpmsdir, relpath)
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            copyFile(os.path.join(self.entry(key), relpath), dest)
+        os.utime(self.entry(key), None)
+        return [os.path.basename(f) for f in files]
+
+    def store(self, key, rpms, inputs, host, deps):
+        """ Store the files rpms (paths RPMS/<arch>/<rpm file>) under key. An entry stored for
+            key by another build at the same time is kept """
+        tmpdir = tempfile.mkdtemp(dir=os.path.join(self.cachedir, 'tmp'), prefix='store-')
+        try:
+            for path in rpms:
+                arch = os.path.basename(os.path.dirname(os.path.abspath(path)))
+                if not os.path.isdir(os.path.join(tmpdir, arch)):
+                    os.makedirs(os.path.join(tmpdir, arch))
+                shutil.copyfile(path, os.path.join(tmpdir, arch, os.path.basename(path)))
+            with open(os.path.join(tmpdir, 'inputs.json'), 'w') as f:
+                json.dump({ 'host': host, 'inputs': inputs, 'deps': deps,
+                            'stored': time.strftime("%Y-%m-%d %H:%M:%S") }, f, indent=1, sort_keys=True)
+            os.chmod(tmpdir, 0o755)
+            self.remove(key)
+            os.rename(tmpdir, self.entry(key))
+        except OSError:
+            if not os.path.isdir(self.entry(key)):
+                raise
+        finally:
+            if os.path.isdir(tmpdir):
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def remove(self, key):
+        """ Remove the entry of key. It is renamed away first, so that it is never seen partly
+            removed """
+        if not os.path.isdir(self.entry(key)):
+            return
+        tmpdir = tempfile.mkdtemp(dir=os.path.join(self.cachedir, 'tmp'), prefix='remove-')
+        try:
+            os.rename(self.entry(key), os.path.join(tmpdir, key))
+        except OSError:
+            # removed by another build
+            pass
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def entries(self):
+        """ (last use, size in bytes, key) of each entry, least recently used first """
+        result = []
+        entriesdir = os.path.join(self.cachedir, 'entries')
+        for key in os.listdir(entriesdir):
+            entry = os.path.join(entriesdir, key)
+            try:
+                used = os.stat(entry).st_mtime
+                size = 0
+                for dirpath, dirnames, filenames in os.walk(entry):
+                    size += sum([os.path.getsize(os.path.join(dirpath, f)) for f in filenames])
+            except OSError:
+                # removed by another build
+                continue
+            result.append((used, size, key))
+        return sorted(result)
+
+    def evict(self, maxSize=None, maxAge=None):
+        """ Remove the entries not used for maxAge days, then the least recently used ones until
+            the cache is not larger than maxSize bytes. Returns the number of entries removed """
+        entries = self.entries()
+        total = sum([e[1] for e in entries])
+        removed = 0
+        for used, size, key in entries:
+            tooOld = maxAge is not None and used < time.time() - maxAge * 86400
+            tooBig = maxSize is not None and total > maxSize
+            if not (tooOld or tooBig):
+                continue
+            self.remove(key)
+            total -= size
+            removed += 1
+        # temporary directories left by interrupted builds
+        tmpdir = os.path.join(self.cachedir, 'tmp')
+        for name in os.listdir(tmpdir):
+            path = os.path.join(tmpdir, name)
+            try:
+                if os.stat(path).st_mtime < time.time() - 86400:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+        return removed
+
+def restore(cache, builddir, patterns, noCache=False, depfiles=()):
+    """ Record the key of builddir in its KEYFILE and restore its RPMs. depfiles are the KEYFILEs
+        of the builds it depends on. Returns True if they were restored """
+    host = hostPlatform()
+    inputs = buildInputs(builddir)
+    deps = depKeys(depfiles)
+    unknown = sorted([name for name in deps if deps[name] is None])
+    if unknown:
+        # a key without the dependency would give back RPMs built against an older one
+        with open(os.path.join(builddir, KEYFILE), 'w') as f:
+            json.dump({ 'key': None }, f)
+        print("rpm-cache: no key for %s, building without the cache" % " ".join(unknown))
+        return False
+    key = buildKey(inputs, host, deps)
+    with open(os.path.join(builddir, KEYFILE), 'w') as f:
+        json.dump({ 'key': key, 'host': host, 'inputs': inputs, 'deps': deps }, f)
+    if noCache:
+        print("rpm-cache: not using the cache, building (key %s)" % key[:12])
+        return False
+    rpms = cache.restore(key, rpmsDir(patterns))
+    if not rpms:
+        print("rpm-cache: not in the cache, building (key %s)" % key[:12])
+        return False
+    for rpm in rpms:
+        print("rpm-cache: %s from the cache (key %s)" % (rpm, key[:12]))
+    return True
+
+def store(cache, builddir, patterns):
+    """ Store the RPMs of the build in builddir under the key recorded by restore """
+    try:
+        with open(os.path.join(builddir, KEYFILE), 'r') as f:
+            state = json.load(f)
+    except (IOError, OSError, ValueError):
+        sys.stderr.write("rpm-cache.py: no key in %s, rpm-cache.py restore was not run\n" % builddir)
+        return
+    if state['key'] is None:
+        print("rpm-cache: the key of a dependency is not known, not stored")
+        return
+    rpms = rpmFiles(patterns)
+    if not rpms:
+        sys.stderr.write("rpm-cache.py: no RPMs match %s, nothing stored\n" % patterns)
+        return
+    cache.store(state['key'], rpms, state['inputs'], state['host'], state['deps'])
+    print("rpm-cache: stored %s (key %s)" % (" ".join([os.path.basename(r) for r in rpms]), state['key'][:12]))
+
+## *****************************
+## main routine
+## *****************************
+
+def main(argv):
+
+    # description and help lines for the usage  help
+    description = "keeps the RPMs of package builds in a cache shared by admixes and build hosts, under\n"
+    description += "the sha256 of the files of the build directory before make pkg\n"
+
+    helpcommand = "restore: copy the RPMs of BUILDDIR from the cache, exit status 1 if not cached\n"
+    helpcommand += "store: store the RPMs of the finished build of BUILDDIR\n"
+    helpcommand += "evict: remove entries by --max-age and --max-size"
+    helpcache = "cache directory, default is $YAML2RPM_RPM_CACHE or ~/.cache/yaml2rpm-rpms.\n"
+    helpcache += "'off' turns the cache off: restore always builds, store does nothing"
+    helpnocache = "restore does not use the cache, the package is built and stored again"
+    helprpms = "space separated file patterns of the RPMs of the package (RPMS/<arch>/<file>),\n"
+    helprpms += "printed by make rpmglob in BUILDDIR"
+    helpdeps = "for restore, space separated %s files of the build directories of the packages\n" % KEYFILE
+    helpdeps += "this one is built against. Their keys are part of its key"
+    helpsize = "after store and for evict, remove the least recently used entries until the cache is\n"
+    helpsize += "not larger than this, e.g. 50G. Default is no limit"
+    helpage = "after store and for evict, remove the entries not used for this many days. Default is\n"
+    helpage += "no limit"
+
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-c", "--cache",    dest="cache",   default=rpmCache.defaultDir(), help=helpcache)
+    parser.add_argument("--no-cache",       dest="noCache", default=False, action='store_true', help=helpnocache)
+    parser.add_argument("-r", "--rpms",     dest="rpms",    default=None, help=helprpms)
+    parser.add_argument("-d", "--deps",     dest="deps",    default="",   help=helpdeps)
+    parser.add_argument("--max-size",       dest="maxSize", default=None, help=helpsize)
+    parser.add_argument("--max-age",        dest="maxAge",  default=None, type=float, help=helpage)
+    # required positional arguments
+    parser.add_argument("command",  action="store", choices=['restore', 'store', 'evict'], help=helpcommand)
+    parser.add_argument("builddir", action="store", nargs='?', default=None, help="package build directory, for restore and store")
+    args = parser.parse_args(argv)
+
+    if args.command != 'evict' and (args.builddir is None or not args.rpms):
+        parser.error("%s needs BUILDDIR and --rpms" % args.command)
+    maxSize = parseSize(args.maxSize) if args.maxSize not in (None, "", "0") else None
+    maxAge = args.maxAge if args.maxAge else None
+    if args.cache is None or args.cache.lower() in ("", "off", "no", "none"):
+        if args.command == 'restore':
+            sys.exit(1)
+        return
+    # the cache must never fail a build, an error is a package that is not cached
+    try:
+        cache = rpmCache(args.cache)
+        if args.command == 'restore':
+            if not restore(cache, args.builddir, args.rpms, args.noCache, args.deps.split()):
+                sys.exit(1)
+            return
+        if args.command == 'store':
+            store(cache, args.builddir, args.rpms)
+        removed = cache.evict(maxSize, maxAge)
+        if removed:
+            print("rpm-cache: %d entries evicted from %s" % (removed, args.cache))
+    except Exception as ex:
+        sys.stderr.write("rpm-cache.py: %s: %s\n" % (args.command, str(ex)))
+        if args.command == 'restore':
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,179 @@
+#!/bin/env python
+# Summarize the build timings of an admix
+#
+# Reads the <yaml name>.timings.json files that builds write to yamlspecs/logs (see
+# builder/phase-timer.py): one JSON line per phase with the wall time, CPU time and peak
+# memory. Prints the elapsed time of the run, the slowest packages and phases, the time
+# spent in each phase over all packages and, given a previous run, the change per package.
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+TIMINGS_SUFFIX = '.timings.json'
+# phase that spans the whole build of a package, recorded by yamlspecs/Makefile
+PACKAGE_PHASE = 'package'
+# time of the package phase not in any other phase: staging, rpmbuild and packaging
+OTHER_PHASE = 'other'
+
+def readTimings(paths):
+    """ package -> list of phase records, from timings files and directories holding them """
+    fnames = []
+    for path in paths:
+        if os.path.isdir(path):
+            fnames.extend(sorted(glob.glob(os.path.join(path, '*' + TIMINGS_SUFFIX))))
+        else:
+            fnames.append(path)
+    timings = {}
+    for fname in fnames:
+        with open(fname, 'r') as f:
+            for n, line in enumerate(f):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    sys.stderr.write("%s:%d: not a timings record, skipped\n" % (fname, n + 1))
+                    continue
+                package = record.get('package') or os.path.basename(fname)[:-len(TIMINGS_SUFFIX)]
+                timings.setdefault(package, []).append(record)
+    return timings
+
+def packageTotal(records):
+    """ (wall, cpu, peak_rss_kb, status) of the build of a package: the package phase if
+        recorded, the sum of the phases otherwise """
+    for r in records:
+        if r['phase'] == PACKAGE_PHASE:
+            return r['wall'], r['cpu'], r['peak_rss_kb'], r['status']
+    status = 0
+    for r in records:
+        status = status or r['status']
+    return (sum([r['wall'] for r in records]), sum([r['cpu'] for r in records]),
+            max([r['peak_rss_kb'] for r in records] + [0]), status)
+
+def phases(records):
+    """ the phase records of a package, with an 'other' phase for the time of the package
+        phase that is not in another phase """
+    inner = [r for r in records if r['phase'] != PACKAGE_PHASE]
+    outer = [r for r in records if r['phase'] == PACKAGE_PHASE]
+    if outer:
+        wall = outer[0]['wall'] - sum([r['wall'] for r in inner])
+        cpu = outer[0]['cpu'] - sum([r['cpu'] for r in inner])
+        inner.append({ 'phase': OTHER_PHASE, 'wall': max(0.0, wall), 'cpu': max(0.0, cpu),
+                       'peak_rss_kb': outer[0]['peak_rss_kb'], 'status': 0 })
+    return inner
+
+def elapsed(timings):
+    """ wall time from the first start to the last end of any recorded phase """
+    starts = [r['start'] for rs in timings.values() for r in rs if 'start' in r]
+    ends = [r['start'] + r['wall'] for rs in timings.values() for r in rs if 'start' in r]
+    if not starts:
+        return 0.0
+    return max(ends) - min(starts)
+
+def hms(seconds):
+    """ seconds as h:mm:ss """
+    seconds = int(round(seconds))
+    return "%d:%02d:%02d" % (seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+def mb(kb):
+    return "%.0f" % (kb / 1024.0)
+
+def change(now, before):
+    """ difference of now to before as +h:mm:ss (+n%) """
+    diff = now - before
+    sign = '-' if diff < 0 else '+'
+    if before > 0:
+        return "%s%s (%s%.0f%%)" % (sign, hms(abs(diff)), sign, abs(diff) * 100.0 / before)
+    return "%s%s" % (sign, hms(abs(diff)))
+
+def report(timings, previous=None, top=10):
+    """ lines of the report of timings, compared with previous if not None """
+    lines = []
+    totals = dict([(p, packageTotal(rs)) for p, rs in timings.items()])
+    summary = "%d packages, %s elapsed, %s package build time, %s CPU" % (len(timings),
+              hms(elapsed(timings)), hms(sum([t[0] for t in totals.values()])),
+              hms(sum([t[1] for t in totals.values()])))
+    failed = sorted([p for p in totals if totals[p][3] != 0])
+    if failed:
+        summary += ", failed: %s" % " ".join(failed)
+    lines.append(summary)
+    prevTotals = {}
+    if previous is not None:
+        prevTotals = dict([(p, packageTotal(rs)) for p, rs in previous.items()])
+        lines.append("previous run: %d packages, %s elapsed, %s package build time (%s)" % (len(previous),
+                     hms(elapsed(previous)), hms(sum([t[0] for t in prevTotals.values()])),
+                     change(elapsed(timings), elapsed(previous))))
+
+    lines.extend(["", "Slowest packages"])
+    header = "  %-32s %10s %10s %9s" % ("package", "wall", "cpu", "peak MB")
+    if previous is not None:
+        header += "  %-10s %s" % ("previous", "change")
+    lines.append(header)
+    ranked = sorted(totals, key=lambda p: (-totals[p][0], p))
+    for p in ranked[:top]:
+        wall, cpu, peak, status = totals[p]
+        line = "  %-32s %10s %10s %9s" % (p, hms(wall), hms(cpu), mb(peak))
+        if previous is not None:
+            if p in prevTotals:
+                line += "  %-10s %s" % (hms(prevTotals[p][0]), change(wall, prevTotals[p][0]))
+            else:
+                line += "  %-10s" % "new"
+        lines.append(line)
+
+    allPhases = [(p, r) for p in timings for r in phases(timings[p])]
+    lines.extend(["", "Slowest phases"])
+    lines.append("  %-32s %-14s %10s %10s %9s" % ("package", "phase", "wall", "cpu", "peak MB"))
+    for p, r in sorted(allPhases, key=lambda x: (-x[1]['wall'], x[0], x[1]['phase']))[:top]:
+        lines.append("  %-32s %-14s %10s %10s %9s" % (p, r['phase'], hms(r['wall']), hms(r['cpu']), mb(r['peak_rss_kb'])))
+
+    byPhase = {}
+    for p, r in allPhases:
+        t = byPhase.setdefault(r['phase'], [0.0, 0.0])
+        t[0] += r['wall']
+        t[1] += r['cpu']
+    total = sum([t[0] for t in byPhase.values()]) or 1.0
+    lines.extend(["", "Time per phase, all packages"])
+    lines.append("  %-14s %10s %10s %6s" % ("phase", "wall", "cpu", "share"))
+    for phase in sorted(byPhase, key=lambda x: -byPhase[x][0]):
+        wall, cpu = byPhase[phase]
+        lines.append("  %-14s %10s %10s %5.1f%%" % (phase, hms(wall), hms(cpu), wall * 100.0 / total))
+
+    if previous is not None:
+        gone = sorted([p for p in previous if p not in timings])
+        if gone:
+            lines.extend(["", "Not in this run: %s" % " ".join(gone)])
+    return lines
+
+## *****************************
+## main routine
+## *****************************
+
+def main(argv):
+
+    # description and help lines for the usage  help
+    description = "summarizes the timings files of package builds, e.g. of make buildall, and compares\n"
+    description += "them with a previous run\n"
+
+    helpprevious = "timings of a previous run (directory or files, comma separated) to compare with"
+
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-p", "--previous", dest="previous", default=None, help=helpprevious)
+    parser.add_argument("-n", "--top",      dest="top",      default=10, type=int, help="number of packages and phases listed, default is 10")
+    # required positional argument
+    parser.add_argument("paths",  action="store", help="directories with <name>%s files (e.g. yamlspecs/logs) or files" % TIMINGS_SUFFIX, nargs='+')
+    args = parser.parse_args(argv)
+
+    timings = readTimings(args.paths)
+    if not timings:
+        sys.stderr.write("no timings found in %s\n" % " ".join(args.paths))
+        sys.exit(1)
+    previous = None
+    if args.previous:
+        previous = readTimings(args.previous.split(','))
+    print("\n".join(report(timings, previous, args.top)))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])